@@ -0,0 +1,55 @@
+# Benchmark: websocket decoding throughput in events/sec per JSON backend and mode
+# Usage: python -m benchmarks.decoder [--frames FILE] [--tracked-ratio 0.2]
+
+from argparse import ArgumentParser
+from asyncio import run
+from time import perf_counter
+from nekopricer.classes.websocket import Websocket
+from nekopricer.library.decoder import BACKENDS, Decoder
+from .frames import frame_item_names, generate_frames, item_names, load_frames
+
+
+async def handle_event(data: dict, event: str, tracked: set) -> bool:
+    # Same checks as Websocket.handle_event, without the database
+    if not data or (data.get("item") or {}).get("name") not in tracked:
+        return False
+    return event == "listing-update" and bool(await Websocket.reformat_event(data))
+
+
+async def consume(decoder: Decoder, frames: list[str], tracked: set) -> int:
+    reformatted = 0
+    for message in frames:
+        events = decoder.decode(message, tracked.__contains__)
+        for event, data in decoder.select(events, tracked.__contains__):
+            reformatted += await handle_event(data, event, tracked)
+    return reformatted
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--frames", help="Recording (.gz) or file with one raw frame per line, synthetic frames are used when omitted")
+    parser.add_argument("--tracked-ratio", type=float, default=0.2, help="Share of events for tracked items (synthetic frames)")
+    arguments = parser.parse_args()
+
+    if arguments.frames:
+        frames = load_frames(arguments.frames)
+        tracked = set(frame_item_names(frames)[::5])
+    else:
+        names = item_names(5_000)
+        frames = generate_frames(names, tracked_ratio=arguments.tracked_ratio)
+        tracked = set(names)
+
+    total = sum(len(Decoder("json").decode(frame)) for frame in frames)
+    print(f"{len(frames)} frames, {total} events, {len(tracked)} tracked items")
+    print(f"{'backend':>8} {'mode':>6} {'events/sec':>12} {'reformatted':>12}")
+    for backend in BACKENDS:
+        for lazy in (False, True):
+            decoder = Decoder(backend, lazy)
+            start = perf_counter()
+            reformatted = run(consume(decoder, frames, tracked))
+            elapsed = perf_counter() - start
+            print(f"{backend:>8} {'lazy' if lazy else 'eager':>6} {total / elapsed:>12,.0f} {reformatted:>12}")
+
+
+if __name__ == "__main__":
+    main()
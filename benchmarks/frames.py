@@ -0,0 +1,102 @@
+# Shared helpers for the benchmarks: synthetic backpack.tf frames and recorded frame files
+
+from json import dumps, loads
+from random import Random
+from nekopricer.library.recording import read_recording
+
+INTENTS = ("buy", "sell")
+
+
+def item_names(count: int) -> list[str]:
+    return [f"Item {index}" for index in range(count)]
+
+
+def build_payload(random: Random, name: str, steamid: str, intent: str) -> dict:
+    # Mirrors the shape of a backpack.tf listing payload, including the parts the pricer ignores
+    keys = random.randint(0, 3)
+    metal = round(random.randint(0, 80) / 9, 2)
+    return {
+        "id": f"440_{steamid}_{random.getrandbits(48):x}",
+        "steamid": steamid,
+        "appid": 440,
+        "currencies": {"keys": keys, "metal": metal} if keys else {"metal": metal},
+        "value": {"raw": keys * 60 + metal, "short": f"{keys} keys, {metal} ref", "long": f"{keys} keys, {metal} ref"},
+        "tradeOffersPreferred": True,
+        "buyoutOnly": True,
+        "details": random.choice(["", "Buying for keys/ref, send me an offer!", "Selling spelled, hh and exorcism!"]),
+        "listedAt": 1_700_000_000 + random.randint(0, 86_400),
+        "bumpedAt": 1_700_000_000 + random.randint(86_400, 172_800),
+        "intent": intent,
+        "count": 1,
+        "status": "active",
+        "source": "userAgent",
+        "item": {
+            "appid": 440,
+            "baseName": name,
+            "defindex": random.randint(1, 30_000),
+            "id": str(random.getrandbits(40)),
+            "imageUrl": "https://steamcdn-a.akamaihd.net/apps/440/icons/item.png",
+            "marketName": name,
+            "name": name,
+            "origin": None,
+            "originalId": str(random.getrandbits(40)),
+            "quality": {"id": 6, "name": "Unique", "color": "#FFD700"},
+            "summary": "Level 1 Hat",
+            "price": {"steam": {"currency": "usd", "short": "$0.50", "long": "0.50 USD", "raw": 0.5}},
+            "class": ["Scout", "Soldier"],
+            "slot": "misc",
+            "tradable": True,
+            "craftable": True,
+            "attributes": [{"defindex": random.choice([142, 214, 379, 1004, 2025]), "value": random.random()} for _ in range(random.randint(1, 5))],
+        },
+        "userAgent": {"client": "TF2Autobot", "lastPulse": 1_700_000_000} if random.random() < 0.7 else None,
+        "user": {"id": steamid, "name": "trader", "avatar": "https://avatars.steamstatic.com/avatar.jpg", "premium": False, "online": True},
+    }
+
+
+# Generate frames where roughly tracked_ratio of the events are for items in names
+def generate_frames(names: list[str], frames: int = 200, frame_size: int = 500, tracked_ratio: float = 0.2, seed: int = 440) -> list[str]:
+    random = Random(seed)
+    untracked = [f"Untracked {index}" for index in range(len(names) * 4 or 1)]
+    steamids = [f"7656119{random.randint(0, 10**10):010d}" for _ in range(2_000)]
+    output = []
+    for _ in range(frames):
+        events = []
+        for _ in range(frame_size):
+            name = random.choice(names) if random.random() < tracked_ratio else random.choice(untracked)
+            steamid = random.choice(steamids)
+            intent = random.choice(INTENTS)
+            if random.random() < 0.8:
+                events.append(
+                    {"id": f"{random.getrandbits(64):x}", "event": "listing-update", "payload": build_payload(random, name, steamid, intent)}
+                )
+            else:
+                events.append(
+                    {
+                        "id": f"{random.getrandbits(64):x}",
+                        "event": "listing-delete",
+                        "payload": {"steamid": steamid, "intent": intent, "item": {"name": name}},
+                    }
+                )
+        output.append(dumps(events, separators=(",", ":")))  # Compact like the websocket sends them
+    return output
+
+
+# Either a recording made with benchmarks.replay or a plain file with one raw frame per line
+def load_frames(path: str) -> list[str]:
+    if path.endswith(".gz"):
+        return [message for _, message in read_recording(path)]
+    with open(path, "r", encoding="utf-8") as file:
+        return [line.rstrip("\n") for line in file if line.strip()]
+
+
+# Item names seen in a list of raw frames, used to build a tracked set for recorded traffic
+def frame_item_names(frames: list[str]) -> list[str]:
+    names = set()
+    for frame in frames:
+        events = loads(frame)
+        for event in events if isinstance(events, list) else [events]:
+            name = (event.get("payload", event).get("item") or {}).get("name")
+            if name:
+                names.add(name)
+    return sorted(names)
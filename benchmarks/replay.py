@@ -0,0 +1,100 @@
+# Record the backpack.tf event stream and replay it against Websocket.start_websocket offline
+# Usage:
+#   python -m benchmarks.replay record recording.gz [--duration 600] [--limit 1000]
+#   python -m benchmarks.replay replay recording.gz [--speed 1|N|0] [--item-list item-list.json]
+# Replays write to the configured database, point MONGO_DB/MONGO_COLLECTION at a scratch collection.
+
+from argparse import ArgumentParser
+from asyncio import create_task, get_running_loop, run, sleep
+from json import load
+from os import environ
+from resource import RUSAGE_SELF, getrusage
+from dotenv import load_dotenv
+
+load_dotenv()
+for variable in ("MASTER_KEY", "BACKPACK_TF_ACCESS_TOKEN", "MINIO_ENDPOINT", "MINIO_ACCESS_KEY", "MINIO_SECRET_KEY"):
+    environ.setdefault(variable, "unused")  # Required by Options, never used by the harness
+
+from nekopricer.classes.database import open_database  # noqa: E402
+from nekopricer.classes.options import Options  # noqa: E402
+from nekopricer.classes.pricelist import Pricelist  # noqa: E402
+from nekopricer.classes.snapshots import Snapshots  # noqa: E402
+from nekopricer.classes.websocket import Websocket  # noqa: E402
+from nekopricer.library.recording import Recorder, Replayer  # noqa: E402
+from nekopricer.library.telemetry import Telemetry  # noqa: E402
+from .frames import frame_item_names  # noqa: E402
+
+
+class Harness:
+    # The parts of Pricer that Websocket uses
+    def __init__(self, url: str, tracked: list[str]):
+        self.options = Options(self)
+        self.options.backpackTfWebsocketUrl = url
+        self.database = open_database(self)
+        self.pricelist = Pricelist(self)
+        self.pricelist.item_list = [{"name": name} for name in tracked]
+        self.pricelist.item_names = set(tracked)
+        self.shards = None
+        self.store = None
+        self.retention = None
+        self.snapshots = Snapshots(self)  # Only its scheduler is used, nothing is fetched
+
+
+async def record(arguments):
+    options = Options(None)
+    recorder = Recorder(options.backpackTfWebsocketUrl, arguments.recording)
+    await recorder.record(arguments.duration, arguments.limit)
+
+
+async def replay(arguments):
+    replayer = Replayer(arguments.recording, arguments.speed)
+    if arguments.item_list:
+        with open(arguments.item_list, "r", encoding="utf-8") as file:
+            tracked = [item["name"] for item in load(file)["items"]]
+    else:
+        tracked = frame_item_names([message for _, message in replayer.frames])
+
+    loop = get_running_loop()
+    async with replayer.serve() as server:
+        port = server.sockets[0].getsockname()[1]
+        websocket = Websocket(Harness(f"ws://127.0.0.1:{port}", tracked))
+        task = create_task(websocket.start_websocket())
+
+        await replayer.finished.wait()
+        while websocket.telemetry.totals["frames"] < replayer.sent:
+            await sleep(0.05)  # Frames still buffered in the client
+        await websocket.ingestion.drain()
+        elapsed = loop.time() - replayer.started
+        task.cancel()
+
+    statistics = websocket.get_statistics()
+    events = statistics["totals"].get("events", 0)
+    print(f"Replayed {replayer.sent} frames, {events} events, {len(tracked)} tracked items at speed {arguments.speed or 'max'}")
+    print(f"Sustained: {events / elapsed:,.0f} events/sec over {elapsed:.1f}s")
+    print(f"Written: {statistics['totals'].get('inserts', 0)} inserts, {statistics['totals'].get('deletes', 0)} deletes")
+    for name in ("frame_latency", "write_latency"):
+        latency = statistics["percentiles"].get(name) or Telemetry.percentiles([])
+        print(f"{name}: p50 {latency['p50'] * 1000:.2f}ms, p95 {latency['p95'] * 1000:.2f}ms, p99 {latency['p99'] * 1000:.2f}ms")
+    print(f"Peak memory: {getrusage(RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+def main():
+    parser = ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Record raw frames from BACKPACK_TF_WEBSOCKET_URL")
+    record_parser.add_argument("recording")
+    record_parser.add_argument("--duration", type=float, help="Seconds to record for")
+    record_parser.add_argument("--limit", type=int, help="Frames to record")
+
+    replay_parser = commands.add_parser("replay", help="Replay a recording against the websocket client")
+    replay_parser.add_argument("recording")
+    replay_parser.add_argument("--speed", type=float, default=0, help="1 for recorded pacing, N for N times faster, 0 for max speed")
+    replay_parser.add_argument("--item-list", help="item-list.json to track, every recorded item is tracked when omitted")
+
+    arguments = parser.parse_args()
+    run(record(arguments) if arguments.command == "record" else replay(arguments))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Benchmark: write throughput of the embedded and per-listing (MONGO_LAYOUT=document) Mongo layouts and the SQLite backend
+# Usage: python -m benchmarks.storage_layout [--items 100] [--operations 200000] [--batch-size 500] [--layouts embedded,document,sqlite]
+# The Mongo layouts need MONGO_URI and write to scratch collections named benchmark_<layout> in MONGO_DB, SQLite writes to a
+# temporary file. Everything is dropped afterwards.
+
+from argparse import ArgumentParser
+from asyncio import run
+from json import loads
+from os import environ, remove
+from tempfile import mkdtemp
+from time import perf_counter
+from dotenv import load_dotenv
+
+load_dotenv()
+for variable in ("MASTER_KEY", "BACKPACK_TF_ACCESS_TOKEN", "MINIO_ENDPOINT", "MINIO_ACCESS_KEY", "MINIO_SECRET_KEY"):
+    environ.setdefault(variable, "unused")  # Required by Options, never used by the benchmark
+
+from nekopricer.classes.database import open_database  # noqa: E402
+from nekopricer.classes.ingestion import Ingestion  # noqa: E402
+from nekopricer.classes.options import Options  # noqa: E402
+from nekopricer.classes.websocket import Websocket  # noqa: E402
+from nekopricer.library.telemetry import Telemetry  # noqa: E402
+from .frames import generate_frames, item_names  # noqa: E402
+
+LAYOUTS = ("embedded", "document", "sqlite")
+
+
+class Harness:
+    def __init__(self, layout: str):
+        self.options = Options(self)
+        if layout == "sqlite":
+            self.options.storageBackend = "sqlite"
+            self.options.sqlitePath = f"{mkdtemp()}/benchmark.db"
+        else:
+            self.options.mongoLayout = layout
+            self.options.mongoCollection = f"benchmark_{layout}"
+        self.database = open_database(self)
+
+    def drop(self):
+        if self.options.storageBackend == "sqlite":
+            self.database.close_connection()
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    remove(self.options.sqlitePath + suffix)
+                except FileNotFoundError:
+                    pass
+            return
+        for name in self.database.database.list_collection_names():
+            if name.startswith(self.options.mongoCollection):
+                self.database.database.drop_collection(name)
+
+
+async def build_operations(names: list[str], count: int) -> list[tuple[str, dict]]:
+    # Websocket operations in arrival order, few items so the embedded arrays grow like popular items do
+    frames = generate_frames(names, frames=count // 500 + 1, frame_size=500, tracked_ratio=1)
+    operations = list()
+    for frame in frames:
+        for event in loads(frame):
+            data = event["payload"]
+            name = data["item"]["name"]
+            if event["event"] == "listing-update":
+                listing_data = await Websocket.reformat_event(data)
+                operations.append(("insert", Websocket.insert_operation(name, listing_data)))
+            else:
+                operations.append(("delete", Websocket.delete_operation(name, data["intent"], data["steamid"])))
+    return operations[:count]
+
+
+def write(harness: Harness, operations: list, batch_size: int) -> list[float]:
+    latencies = list()
+    for index in range(0, len(operations), batch_size):
+        batch, _ = Ingestion.coalesce(operations[index : index + batch_size])
+        start = perf_counter()
+        harness.database.update_many(batch)
+        latencies.append(perf_counter() - start)
+    return latencies
+
+
+def read(harness: Harness, names: list[str]) -> float:
+    start = perf_counter()
+    for name in names:
+        harness.database.get_listings_by_intent(name, "buy")
+        harness.database.get_listings_by_intent(name, "sell")
+    return perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--items", type=int, default=100, help="Tracked items the listings are spread over")
+    parser.add_argument("--operations", type=int, default=200_000, help="Websocket operations to write")
+    parser.add_argument("--batch-size", type=int, default=500, help="Operations per bulk write, as INGEST_BATCH_SIZE")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS), help="Comma separated, the Mongo layouts are skipped without MONGO_URI")
+    arguments = parser.parse_args()
+    layouts = [layout for layout in arguments.layouts.split(",") if layout == "sqlite" or environ.get("MONGO_URI")]
+
+    names = item_names(arguments.items)
+    operations = run(build_operations(names, arguments.operations))
+    print(f"{len(operations)} operations over {len(names)} items, batches of {arguments.batch_size}")
+
+    for layout in layouts:
+        harness = Harness(layout)
+        harness.drop()
+        harness.database.create_index()
+        try:
+            start = perf_counter()
+            latencies = write(harness, operations, arguments.batch_size)
+            elapsed = perf_counter() - start
+            reads = read(harness, names)
+            latency = Telemetry.percentiles(latencies)
+            print(
+                f"{layout:>8}: {len(operations) / elapsed:>10,.0f} ops/sec, "
+                f"batch p50 {latency['p50'] * 1000:.1f}ms p99 {latency['p99'] * 1000:.1f}ms, "
+                f"reads {reads / (len(names) * 2) * 1000:.2f}ms per intent"
+            )
+        finally:
+            harness.drop()
+            harness.database.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Benchmark: cost of filtering one websocket frame against the tracked item list
+# Usage: python -m benchmarks.websocket_filter
+
+from types import SimpleNamespace
+from timeit import timeit
+from nekopricer.classes.pricelist import Pricelist
+
+FRAME_SIZE = 500
+RUNS = 3
+
+
+def build_frame(tracked: int) -> list:
+    # Half of the events hit tracked items, the other half are noise
+    return [
+        {"event": "listing-update", "payload": {"item": {"name": f"Item {index * 2 if index % 2 else tracked + index}"}}}
+        for index in range(FRAME_SIZE)
+    ]
+
+
+def list_filter(pricelist: Pricelist, frame: list) -> int:
+    matched = 0
+    for event in frame:
+        item_name = event["payload"]["item"]["name"]
+        item_names = [item["name"] for item in pricelist.item_list]
+        if item_name in item_names:
+            matched += 1
+    return matched
+
+
+def index_filter(pricelist: Pricelist, frame: list) -> int:
+    matched = 0
+    for event in frame:
+        if pricelist.is_tracked(event["payload"]["item"]["name"]):
+            matched += 1
+    return matched
+
+
+def main():
+    print(f"Per-frame filtering cost ({FRAME_SIZE} events, best of {RUNS})")
+    print(f"{'tracked':>8} {'list rebuild':>14} {'hashed index':>14} {'speedup':>10}")
+    for tracked in (1_000, 10_000, 50_000):
+        pricelist = Pricelist(SimpleNamespace())
+        pricelist.item_list = [{"name": f"Item {index}"} for index in range(tracked)]
+        pricelist.item_names = {item["name"] for item in pricelist.item_list}
+        frame = build_frame(tracked)
+        assert list_filter(pricelist, frame) == index_filter(pricelist, frame)
+
+        list_time = min(timeit(lambda: list_filter(pricelist, frame), number=1) for _ in range(RUNS))
+        index_time = min(timeit(lambda: index_filter(pricelist, frame), number=1) for _ in range(RUNS))
+        print(f"{tracked:>8} {list_time * 1000:>11.2f} ms {index_time * 1000:>11.3f} ms {list_time / index_time:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,21 +4,97 @@ if TYPE_CHECKING:
     from .pricer import Pricer
 
 from logging import getLogger
-from pymongo import MongoClient, UpdateOne
+from asyncio import get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, UTC
+from functools import partial
+from time import time
+from typing import Iterator
+from pymongo import MongoClient, ReturnDocument, UpdateOne, ReplaceOne, DeleteOne
+from pymongo.errors import OperationFailure
+from .sqlite import SQLiteDatabase
+from .storage import Storage
+from ..library.listings import FLAG_FIELDS
 
 
-class Database:
+# Aggregation expressions for the listing fields Pricer.calculate_price reads, listing is "$$this." inside
+# an embedded array or "$" for a listing document. Listings stored before the ingest projection get is_bot
+# and attributes derived from user_agent and item.attributes
+def pricing_fields(listing: str) -> dict:
+    return {
+        "steamid": f"{listing}steamid",
+        "intent": f"{listing}intent",
+        "currencies": f"{listing}currencies",
+        "details": f"{listing}details",
+        "listed_at": f"{listing}listed_at",
+        "bumped_at": f"{listing}bumped_at",
+        "is_bot": {"$ifNull": [f"{listing}is_bot", {"$gt": [f"{listing}user_agent", None]}]},
+        "attributes": {"$ifNull": [f"{listing}attributes", {"$ifNull": [f"{listing}item.attributes.defindex", []]}]},
+        **{key: f"{listing}{key}" for key in FLAG_FIELDS},
+    }
+
+
+# Stage 1 of Pricer.calculate_price for one item as an aggregation projection, listings is an array
+# expression of the item's listings and criteria comes from Pricer.pushdown_criteria. Only the top
+# limit + 1 listings of each intent are returned, enough for the limit checks and every strategy.
+# Listings with flags from other options are counted in "stale", those items are priced from a full read
+def top_listings(name: str, listings: str, criteria: dict) -> dict:
+    def intent_listings(intent: str) -> dict:
+        candidates = {
+            "$filter": {
+                "input": listings,
+                "as": "listing",
+                "cond": {"$and": [{"$eq": ["$$listing.intent", intent]}, {"$not": [{"$in": ["$$listing.steamid", criteria["excluded_steamids"]]}]}]},
+            }
+        }
+        conditions = [
+            {"$ne": ["$$listing.excluded", True]},
+            {"$ne": ["$$listing.has_usd", True]},
+            {"$or": [{"$in": [name, criteria["paints"]]}, {"$ne": ["$$listing.blocked", True]}]},
+        ]
+        if criteria["only_bots"][intent]:
+            # Humans are only used when there are no bots
+            conditions.append({"$or": [{"$not": [{"$in": [True, "$$candidates.is_bot"]}]}, {"$eq": ["$$listing.is_bot", True]}]})
+        valued = {
+            "$map": {
+                "input": {"$filter": {"input": "$$candidates", "as": "listing", "cond": {"$and": conditions}}},
+                "as": "listing",
+                "in": {
+                    "$mergeObjects": [
+                        "$$listing",
+                        {"value": {"$add": ["$$listing.scrap", {"$multiply": ["$$listing.keys", criteria["key_scrap"]]}]}},
+                    ]
+                },
+            }
+        }
+        ordered = {"$sortArray": {"input": valued, "sortBy": {"value": -1 if intent == "buy" else 1}}}  # MongoDB 5.2+
+        return {"$let": {"vars": {"candidates": candidates}, "in": {"$slice": [ordered, criteria["limits"][intent] + 1]}}}
+
+    return {
+        "_id": 0,
+        "name": name,
+        "stale": {"$size": {"$filter": {"input": listings, "cond": {"$ne": ["$$this.flags_version", criteria["version"]]}}}},
+        "buy": intent_listings("buy"),
+        "sell": intent_listings("sell"),
+    }
+
+
+class Database(Storage):
     logger = getLogger("Database")
 
+    change_streams = True
+
     def __init__(self, pricer: "Pricer"):
         self.pricer = pricer
 
         self.client = MongoClient(self.pricer.options.mongoUri)
         self.database = self.client[self.pricer.options.mongoDb]
         self.collection = self.database[self.pricer.options.mongoCollection]
+        self.resume_tokens = self.database[f"{self.pricer.options.mongoCollection}_resume_tokens"]
 
     def create_index(self):
         self.collection.create_index([("name", 1)], unique=True)
+        self.collection.create_index([("listings.steamid", 1)])  # Multikey, for get_items_by_steamids
 
     def insert_listing(self, name: str, intent: str, steamid: str, listing_data: dict):
         self.delete_listing(name, intent, steamid)
@@ -47,8 +123,10 @@ class Database:
                     {"name": operation["name"]},
                     {
                         "$pull": {
-                            "listings": {"steamid": operation["steamid"]},
-                            "intent": operation["intent"],
+                            "listings": {
+                                "steamid": operation["steamid"],
+                                "intent": operation["intent"],
+                            }
                         }
                     },
                 )
@@ -85,6 +163,42 @@ class Database:
     def update_snapshot_time(self, name: str, snapshot_time: float):
         self.collection.update_one({"name": name}, {"$set": {"snapshot_time": snapshot_time}})
 
+    def apply_snapshot(self, name: str, listings: list, snapshot_time: float) -> list:
+        # Merged on the server in one document update: stored listings bumped after the snapshot was taken
+        # win over the snapshot's copy, everything else is replaced by the snapshot
+        def active_at(listing: str) -> dict:
+            return {"$ifNull": [f"{listing}.bumped_at", {"$ifNull": [f"{listing}.listed_at", 0]}]}
+
+        def key(listing: str) -> dict:
+            return {"$concat": [f"{listing}.intent", ":", f"{listing}.steamid"]}
+
+        newer = {"$filter": {"input": {"$ifNull": ["$listings", []]}, "as": "listing", "cond": {"$gt": [active_at("$$listing"), snapshot_time]}}}
+        merged = {
+            "$let": {
+                "vars": {"newer": newer},
+                "in": {
+                    "$concatArrays": [
+                        "$$newer",
+                        {
+                            "$filter": {
+                                "input": {"$literal": listings},
+                                "as": "listing",
+                                "cond": {"$not": [{"$in": [key("$$listing"), {"$map": {"input": "$$newer", "as": "newer", "in": key("$$newer")}}]}]},
+                            }
+                        },
+                    ]
+                },
+            }
+        }
+        document = self.collection.find_one_and_update(
+            {"name": name},
+            [{"$set": {"listings": merged, "snapshot_time": snapshot_time}}],
+            projection={"_id": 0, "listings": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return document["listings"]
+
     def get_snapshot_time(self, name: str) -> float:
         snapshot_time = self.collection.find_one({"name": name}, {"snapshot_time": 1})
         return snapshot_time.get("snapshot_time") if snapshot_time else 0
@@ -96,22 +210,16 @@ class Database:
             snapshot_times[document["name"]] = document.get("snapshot_time", 0)
         return snapshot_times
 
-    def delete_old_listings(self, max_time: float):
-        self.collection.update_many(
-            {},
-            [
-                {
-                    "$set": {
-                        "listings": {
-                            "$filter": {
-                                "input": "$listings",
-                                "cond": {"$gte": ["$$this.updated", max_time]},
-                            }
-                        }
-                    }
-                }
-            ],
+    def prune_listings(self, names: list[str], min_time: float) -> int:
+        # Drop listings last bumped (or listed) before min_time from a batch of items, only documents
+        # holding a stale listing are rewritten
+        stale = {"$or": [{"bumped_at": {"$lt": min_time}}, {"bumped_at": None, "listed_at": {"$lt": min_time}}]}
+        active_at = {"$ifNull": ["$$this.bumped_at", {"$ifNull": ["$$this.listed_at", min_time]}]}
+        result = self.collection.update_many(
+            {"name": {"$in": names}, "listings": {"$elemMatch": stale}},
+            [{"$set": {"listings": {"$filter": {"input": "$listings", "cond": {"$gte": [active_at, min_time]}}}}}],
         )
+        return result.modified_count
 
     def delete_item(self, name: str):
         self.collection.delete_one({"name": name})
@@ -131,5 +239,361 @@ class Database:
             return result["listings"]
         return []
 
+    def get_items_by_steamids(self, steamids: list[str]) -> dict:
+        pipeline = [
+            {"$match": {"listings.steamid": {"$in": steamids}}},
+            {"$unwind": "$listings"},
+            {"$match": {"listings.steamid": {"$in": steamids}}},
+            {"$group": {"_id": "$listings.steamid", "names": {"$addToSet": "$name"}}},
+        ]
+        return {result["_id"]: sorted(result["names"]) for result in self.collection.aggregate(pipeline)}
+
+    # Both intents of one item split and projected on the server, for pricing a single item on demand
+    def get_pricing_listings(self, name: str) -> dict:
+        pipeline = [
+            {"$match": {"name": name}},
+            {
+                "$project": {
+                    "_id": 0,
+                    **{
+                        intent: {
+                            "$map": {
+                                "input": {"$filter": {"input": {"$ifNull": ["$listings", []]}, "cond": {"$eq": ["$$this.intent", intent]}}},
+                                "in": pricing_fields("$$this."),
+                            }
+                        }
+                        for intent in ("buy", "sell")
+                    },
+                }
+            },
+        ]
+        for document in self.collection.aggregate(pipeline):
+            return document
+        return {"buy": list(), "sell": list()}
+
+    # Listings for many items in a few $in cursors, yields (name, {"buy": [...], "sell": [...]}) in the order of names
+    # one batch at a time so only batch_size items are held in memory
+    def iter_listings(self, names: list[str], batch_size: int = 100) -> Iterator[tuple[str, dict]]:
+        for index in range(0, len(names), batch_size):
+            batch = names[index : index + batch_size]
+            listings = {name: {"buy": list(), "sell": list()} for name in batch}
+            for document in self.collection.find({"name": {"$in": batch}}, {"_id": 0, "name": 1, "listings": 1}):
+                for listing in document.get("listings") or []:
+                    if listing.get("intent") in ("buy", "sell"):
+                        listings[document["name"]][listing["intent"]].append(listing)
+            for name in batch:
+                yield name, listings[name]
+
+    # Like iter_listings, with stage 1 of the pricer run by Mongo so only the listings it uses are returned
+    def iter_top_listings(self, names: list[str], batch_size: int, criteria: dict) -> Iterator[tuple[str, dict]]:
+        for index in range(0, len(names), batch_size):
+            batch = names[index : index + batch_size]
+            pipeline = [{"$match": {"name": {"$in": batch}}}, {"$project": top_listings("$name", {"$ifNull": ["$listings", []]}, criteria)}]
+            yield from self.collect_top_listings(batch, self.collection.aggregate(pipeline, allowDiskUse=True))
+
+    def collect_top_listings(self, batch: list[str], documents) -> Iterator[tuple[str, dict]]:
+        listings = {name: {"buy": list(), "sell": list()} for name in batch}
+        stale = set()
+        for document in documents:
+            listings[document["name"]] = {"buy": document["buy"], "sell": document["sell"]}
+            if document["stale"]:
+                stale.add(document["name"])
+        for name in batch:
+            yield name, self.get_pricing_listings(name) if name in stale else listings[name]
+
+    # Rewrite the precomputed flags of stored listings, updates are (name, intent, steamid, flags)
+    def update_flags(self, updates: list[tuple[str, str, str, float, dict]]):
+        bulk = [
+            UpdateOne(
+                {"name": name},
+                {"$set": {f"listings.$[listing].{key}": value for key, value in flags.items()}},
+                array_filters=[{"listing.steamid": steamid, "listing.intent": intent, "listing.bumped_at": bumped_at}],
+            )
+            for name, intent, steamid, bumped_at, flags in updates
+        ]
+        self.collection.bulk_write(bulk, ordered=False) if bulk else None
+
+    def migrate(self) -> int:
+        return 0  # Already the embedded layout
+
+    # Change streams, every document is a whole item so updates are looked up in full
+    def watch(self, resume_after: dict = None):
+        return self.collection.watch(full_document="updateLookup", resume_after=resume_after)
+
+    # What a change event means for a listing store, either {"replace": name, "listings": [...]} or an
+    # ingestion style {"insert": [...], "delete": [...]} batch. None when there is nothing to apply
+    def decode_change(self, change: dict) -> dict:
+        document = change.get("fullDocument")
+        if change["operationType"] in ("insert", "update", "replace") and document:
+            return {"replace": document["name"], "listings": document.get("listings") or []}
+        return None  # Items are only deleted by a snapshot refresh, which inserts them again right after
+
+    def get_resume_token(self, node: str) -> dict:
+        document = self.resume_tokens.find_one({"node": node})
+        return document.get("token") if document else None
+
+    def set_resume_token(self, node: str, token: dict):
+        self.resume_tokens.update_one({"node": node}, {"$set": {"token": token}}, upsert=True)
+
     def close_connection(self):
         self.client.close()
+
+
+class DocumentDatabase(Database):
+    # One document per (name, intent, steamid) instead of an embedded listings array per item,
+    # writes touch a single small document and per-intent reads are served by the compound index
+    logger = getLogger("DocumentDatabase")
+
+    ttl_expiry = True
+
+    def __init__(self, pricer: "Pricer"):
+        super().__init__(pricer)
+
+        self.embedded = self.collection  # The embedded layout collection, only read by migrate()
+        self.collection = self.database[f"{self.pricer.options.mongoCollection}_listings"]
+        self.snapshots = self.database[f"{self.pricer.options.mongoCollection}_snapshots"]
+
+    @staticmethod
+    def listing_filter(name: str, intent: str, steamid: str) -> dict:
+        return {"name": name, "intent": intent, "steamid": steamid}
+
+    def create_index(self):
+        self.collection.create_index([("name", 1), ("intent", 1), ("steamid", 1)], unique=True)
+        self.collection.create_index([("steamid", 1), ("name", 1)])  # Covers get_items_by_steamids
+        self.snapshots.create_index([("name", 1)], unique=True)
+
+        max_age = self.pricer.options.listingMaxAge
+        try:
+            self.collection.create_index([("active_at", 1)], expireAfterSeconds=max_age)
+        except OperationFailure:
+            # LISTING_MAX_AGE changed since the index was created
+            self.database.command("collMod", self.collection.name, index={"keyPattern": {"active_at": 1}, "expireAfterSeconds": max_age})
+            self.logger.info(f"Updated the listing TTL to {max_age} seconds.")
+
+    @staticmethod
+    def listing_document(name: str, listing_data: dict) -> dict:
+        # active_at is the date the TTL index expires the listing from, Mongo only expires BSON dates
+        active_at = listing_data.get("bumped_at") or listing_data.get("listed_at") or time()
+        return {**listing_data, "name": name, "active_at": datetime.fromtimestamp(float(active_at), UTC)}
+
+    def insert_listing(self, name: str, intent: str, steamid: str, listing_data: dict):
+        self.collection.replace_one(self.listing_filter(name, intent, steamid), self.listing_document(name, listing_data), upsert=True)
+
+    def delete_listing(self, name: str, intent: str, steamid: str):
+        self.collection.delete_one(self.listing_filter(name, intent, steamid))
+
+    def update_many(self, listings_to_update: dict):
+        bulk = list()
+        for operation in listings_to_update.get("insert", []):
+            bulk.append(
+                ReplaceOne(
+                    self.listing_filter(operation["name"], operation["intent"], operation["steamid"]),
+                    self.listing_document(operation["name"], operation["listing_data"]),
+                    upsert=True,
+                )
+            )
+        for operation in listings_to_update.get("delete", []):
+            bulk.append(DeleteOne(self.listing_filter(operation["name"], operation["intent"], operation["steamid"])))
+
+        # Every operation targets its own document, order only matters for repeated keys which ingestion coalesces
+        self.collection.bulk_write(bulk, ordered=False) if bulk else None
+
+    def update_snapshot_time(self, name: str, snapshot_time: float):
+        self.snapshots.update_one({"name": name}, {"$set": {"snapshot_time": snapshot_time}}, upsert=True)
+
+    def apply_snapshot(self, name: str, listings: list, snapshot_time: float) -> list:
+        # Only the listings that changed are written, in one unordered bulk write. Stored listings bumped after
+        # the snapshot was taken are kept, and every write is guarded on active_at so a websocket write that
+        # lands in between isn't undone
+        snapshot_at = datetime.fromtimestamp(float(snapshot_time), UTC)
+        stored = {(document["intent"], document["steamid"]): document for document in self.collection.find({"name": name}, {"_id": 0})}
+        result = dict()
+        bulk = list()
+        for listing in listings:
+            key = (listing.get("intent"), listing.get("steamid"))
+            previous = stored.pop(key, None)
+            document = self.listing_document(name, listing)
+            if previous is None:
+                bulk.append(UpdateOne(self.listing_filter(name, *key), {"$setOnInsert": document}, upsert=True))
+            elif self.listing_time(previous) > snapshot_time:
+                listing = previous
+            elif {**previous, "active_at": None} != {**document, "active_at": None}:
+                bulk.append(ReplaceOne({**self.listing_filter(name, *key), "active_at": {"$lte": snapshot_at}}, document))
+            result[key] = listing
+        for key, previous in stored.items():
+            if self.listing_time(previous) > snapshot_time:
+                result[key] = previous
+            else:
+                bulk.append(DeleteOne({**self.listing_filter(name, *key), "active_at": {"$lte": snapshot_at}}))
+        self.collection.bulk_write(bulk, ordered=False) if bulk else None
+        self.update_snapshot_time(name, snapshot_time)
+        return [{key: value for key, value in listing.items() if key not in ("name", "active_at")} for listing in result.values()]
+
+    @staticmethod
+    def listing_time(listing: dict) -> float:
+        return listing.get("bumped_at") or listing.get("listed_at") or 0
+
+    def get_snapshot_time(self, name: str) -> float:
+        snapshot_time = self.snapshots.find_one({"name": name}, {"snapshot_time": 1})
+        return snapshot_time.get("snapshot_time") if snapshot_time else 0
+
+    def get_all_snapshot_times(self) -> dict:
+        cursor = self.snapshots.find({}, {"_id": 0, "name": 1, "snapshot_time": 1})
+        return {document["name"]: document.get("snapshot_time", 0) for document in cursor}
+
+    def prune_listings(self, names: list[str], min_time: float) -> int:
+        return 0  # Expired by the TTL index on active_at
+
+    def delete_item(self, name: str):
+        self.collection.delete_many({"name": name})
+        self.snapshots.delete_one({"name": name})
+
+    def get_listings_by_intent(self, name: str, intent: str) -> list:
+        return list(self.collection.find({"name": name, "intent": intent}, {"_id": 0, "name": 0, "active_at": 0}))
+
+    def get_listings(self, name: str) -> list:
+        return list(self.collection.find({"name": name}, {"_id": 0, "name": 0, "active_at": 0}))
+
+    def get_items_by_steamids(self, steamids: list[str]) -> dict:
+        pipeline = [
+            {"$match": {"steamid": {"$in": steamids}}},
+            {"$group": {"_id": "$steamid", "names": {"$addToSet": "$name"}}},
+        ]
+        return {result["_id"]: sorted(result["names"]) for result in self.collection.aggregate(pipeline)}
+
+    def get_pricing_listings(self, name: str) -> dict:
+        pipeline = [
+            {"$match": {"name": name, "intent": {"$in": ["buy", "sell"]}}},
+            {"$project": {"_id": 0, **pricing_fields("$")}},
+        ]
+        listings = {"buy": list(), "sell": list()}
+        for listing in self.collection.aggregate(pipeline):
+            listings[listing["intent"]].append(listing)
+        return listings
+
+    def iter_listings(self, names: list[str], batch_size: int = 100) -> Iterator[tuple[str, dict]]:
+        for index in range(0, len(names), batch_size):
+            batch = names[index : index + batch_size]
+            listings = {name: {"buy": list(), "sell": list()} for name in batch}
+            for listing in self.collection.find({"name": {"$in": batch}, "intent": {"$in": ["buy", "sell"]}}, {"_id": 0, "active_at": 0}):
+                listings[listing.pop("name")][listing["intent"]].append(listing)
+            for name in batch:
+                yield name, listings[name]
+
+    def iter_top_listings(self, names: list[str], batch_size: int, criteria: dict) -> Iterator[tuple[str, dict]]:
+        for index in range(0, len(names), batch_size):
+            batch = names[index : index + batch_size]
+            pipeline = [
+                {"$match": {"name": {"$in": batch}, "intent": {"$in": ["buy", "sell"]}}},
+                {"$group": {"_id": "$name", "listings": {"$push": "$$ROOT"}}},
+                {"$project": top_listings("$_id", "$listings", criteria)},
+            ]
+            yield from self.collect_top_listings(batch, self.collection.aggregate(pipeline, allowDiskUse=True))
+
+    def update_flags(self, updates: list[tuple[str, str, str, float, dict]]):
+        bulk = [
+            UpdateOne({**self.listing_filter(name, intent, steamid), "bumped_at": bumped_at}, {"$set": flags})
+            for name, intent, steamid, bumped_at, flags in updates
+        ]
+        self.collection.bulk_write(bulk, ordered=False) if bulk else None
+
+    def watch(self, resume_after: dict = None):
+        # Deletes only carry the _id, pre-images give the watcher the name, intent and steamid (MongoDB 6.0+)
+        try:
+            self.database.command("collMod", self.collection.name, changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as e:
+            self.logger.warning(f"Failed to enable change stream pre-images, deletes can't be applied by watchers: {e}")
+        return self.collection.watch(full_document="updateLookup", full_document_before_change="whenAvailable", resume_after=resume_after)
+
+    def decode_change(self, change: dict) -> dict:
+        match change["operationType"]:
+            case "insert" | "update" | "replace":
+                document = change.get("fullDocument")
+                action = "insert"
+            case "delete":
+                document = change.get("fullDocumentBeforeChange")
+                action = "delete"
+            case _:
+                return None
+        if not document:
+            return None
+        operation = self.listing_filter(document["name"], document.get("intent"), document.get("steamid"))
+        if action == "insert":
+            operation["listing_data"] = {key: value for key, value in document.items() if key not in ("_id", "name", "active_at")}
+        return {"insert": [operation] if action == "insert" else [], "delete": [operation] if action == "delete" else []}
+
+    def migrate(self, batch_size: int = 1000) -> int:
+        # Copy the embedded layout over, then rename it so the next start doesn't migrate again.
+        # $setOnInsert never overwrites a listing the websocket wrote since, an interrupted migration is simply rerun.
+        if self.embedded.name not in self.database.list_collection_names():
+            return 0
+
+        self.logger.info(f"Migrating {self.embedded.name} to the per-listing layout...")
+        migrated = 0
+        bulk = list()
+        snapshot_bulk = list()
+        for document in self.embedded.find({}, {"_id": 0}):
+            for listing in document.get("listings") or []:
+                listing_filter = self.listing_filter(document["name"], listing.get("intent"), listing.get("steamid"))
+                bulk.append(
+                    UpdateOne(listing_filter, {"$setOnInsert": {**self.listing_document(document["name"], listing), **listing_filter}}, upsert=True)
+                )
+            if "snapshot_time" in document:
+                snapshot_bulk.append(
+                    UpdateOne({"name": document["name"]}, {"$setOnInsert": {"snapshot_time": document["snapshot_time"]}}, upsert=True)
+                )
+            if len(bulk) >= batch_size:
+                migrated += len(bulk)
+                self.collection.bulk_write(bulk, ordered=False)
+                bulk = list()
+        if bulk:
+            migrated += len(bulk)
+            self.collection.bulk_write(bulk, ordered=False)
+        self.snapshots.bulk_write(snapshot_bulk, ordered=False) if snapshot_bulk else None
+
+        self.embedded.rename(f"{self.embedded.name}_embedded", dropTarget=True)
+        self.logger.info(f"Migrated {migrated} listings, the old collection was kept as {self.embedded.name}_embedded.")
+        return migrated
+
+
+def open_database(pricer: "Pricer") -> Storage:
+    # STORAGE_BACKEND selects the storage, MONGO_LAYOUT how listings are stored in Mongo
+    match pricer.options.storageBackend:
+        case "sqlite":
+            return SQLiteDatabase(pricer)
+        case "mongo":
+            if not pricer.options.mongoUri:
+                raise Exception("Missing required environment variable: MONGO_URI")
+        case _:
+            raise Exception(f"Unknown STORAGE_BACKEND: {pricer.options.storageBackend}")
+
+    match pricer.options.mongoLayout:
+        case "document":
+            return DocumentDatabase(pricer)
+        case "embedded":
+            return Database(pricer)
+        case _:
+            raise Exception(f"Unknown MONGO_LAYOUT: {pricer.options.mongoLayout}")
+
+
+class AsyncDatabase:
+    # Runs the blocking calls of a Storage on a thread pool so they can be awaited
+    # without stalling the event loop (frame reading, pings, the ingestion writer)
+    logger = getLogger("AsyncDatabase")
+
+    def __init__(self, database: Storage, max_workers: int = 4):
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Database")
+
+    def __getattr__(self, name: str):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+
+        async def run_in_executor(*args, **kwargs):
+            return await get_running_loop().run_in_executor(self.executor, partial(method, *args, **kwargs))
+
+        return run_in_executor
+
+    def close(self):
+        self.executor.shutdown(wait=True)
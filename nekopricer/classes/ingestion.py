@@ -0,0 +1,125 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+    from .database import AsyncDatabase
+
+from logging import getLogger
+from asyncio import Queue, Task, create_task, get_running_loop, wait_for
+from time import perf_counter, time
+from ..library.telemetry import Telemetry
+
+
+class Ingestion:
+    logger = getLogger("Ingestion")
+
+    def __init__(self, pricer: "Pricer", database: "AsyncDatabase", telemetry: Telemetry):
+        self.pricer = pricer
+        self.database = database
+        self.telemetry = telemetry
+
+        self.queue_size = self.pricer.options.ingestQueueSize
+        self.batch_size = self.pricer.options.ingestBatchSize
+        self.flush_interval = self.pricer.options.ingestFlushInterval
+
+        self.queue: Queue = None  # Created on the websocket event loop
+        self.writer_task: Task = None
+
+    def start(self):
+        self.queue = Queue(maxsize=self.queue_size)
+        self.writer_task = create_task(self.writer())
+        self.logger.debug(f"Started writer (Queue: {self.queue_size}) (Batch: {self.batch_size}) (Interval: {self.flush_interval}s)")
+
+    async def put(self, action: str, operation: dict):
+        if self.queue.full():
+            # The reader stops here until the writer catches up
+            self.telemetry.increment("backpressure")
+            self.logger.debug(f"Ingestion queue is full ({self.queue_size}), applying backpressure.")
+        await self.queue.put((action, operation))
+        self.telemetry.increment("queued")
+
+    async def writer(self):
+        while True:
+            operations = await self.collect()
+            batch, coalesced = self.coalesce(operations)
+            await self.flush(batch, len(operations), coalesced)
+            for _ in operations:
+                self.queue.task_done()
+
+    # Wait until everything queued so far has been flushed
+    async def drain(self):
+        await self.queue.join()
+
+    async def collect(self) -> list:
+        # Wait for the first operation, then fill the batch until it is full or the window closes
+        operations = [await self.queue.get()]
+        loop = get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(operations) < self.batch_size:
+            if self.queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    operations.append(await wait_for(self.queue.get(), timeout))
+                except TimeoutError:
+                    break
+            else:
+                operations.append(self.queue.get_nowait())
+        return operations
+
+    @staticmethod
+    def coalesce(operations: list) -> tuple[dict, int]:
+        # Collapse the batch to the final state per listing, the last write wins so a delete cancels earlier updates
+        # and an update after a delete replaces it (inserts already pull the previous listing)
+        latest = dict()
+        for action, operation in operations:
+            latest[(operation["name"], operation["steamid"], operation["intent"])] = (action, operation)
+
+        batch = {"insert": list(), "delete": list()}
+        for action, operation in latest.values():
+            batch[action].append(operation)
+        return batch, len(operations) - len(latest)
+
+    async def flush(self, batch: dict, size: int, coalesced: int):
+        start = perf_counter()
+        try:
+            await self.database.update_many(batch)
+        except Exception as e:
+            self.telemetry.increment("failed_flushes")
+            self.logger.error(f"Failed to flush {size} operations: {e}")
+            return
+        latency = perf_counter() - start
+        committed = time()
+        if self.pricer.store:
+            self.pricer.store.apply(batch)
+        if self.pricer.retention and batch["insert"]:
+            await self.trim({operation["name"] for operation in batch["insert"]})
+
+        self.telemetry.increment("flushes")
+        self.telemetry.increment("inserts", len(batch["insert"]))
+        self.telemetry.increment("deletes", len(batch["delete"]))
+        self.telemetry.increment("coalesced", coalesced)
+        self.telemetry.observe("flush_size", size)
+        self.telemetry.observe("write_latency", latency)
+        # End-to-end lag, from the listing being bumped (or listed) on backpack.tf to the commit here
+        lag = list()
+        for operation in batch["insert"]:
+            timestamp = operation["listing_data"].get("bumped_at") or operation["listing_data"].get("listed_at")
+            if timestamp:
+                lag.append(committed - timestamp)
+        self.telemetry.observe("lag", *lag)
+        self.logger.debug(
+            f"Flushed {size} operations (Inserts: {len(batch["insert"])}) (Deletes: {len(batch["delete"])}) (Coalesced: {coalesced})"
+            f" in {latency * 1000:.1f}ms (Queue depth: {self.queue.qsize()})"
+        )
+
+    async def trim(self, names: set):
+        # Only items that got new listings can have grown past the retention window
+        try:
+            await get_running_loop().run_in_executor(self.database.executor, self.pricer.retention.trim, list(names))
+        except Exception as e:
+            self.logger.error(f"Failed to trim {len(names)} items: {e}")
+
+    def get_statistics(self) -> dict:
+        return {"depth": self.queue.qsize() if self.queue else 0, "size": self.queue_size}
@@ -7,8 +7,10 @@ from logging import getLogger
 from typing import TypedDict
 from json import loads, dumps
 from os import getenv
-from jsonschema import validate
+from socket import gethostname
+from jsonschema import validate, ValidationError
 from ..schemas.options import options_schema
+from ..library.listings import FlagRules
 
 
 class MaxPercentageDifferences(TypedDict):
@@ -218,6 +220,9 @@ class Options:
     backpackTfAccessToken: str
     backpackTfSnapshotUrl: str
     backpackTfWebsocketUrl: str
+    websocketJsonBackend: str
+    websocketLazyDecode: bool | str
+    resyncMaxItems: int
 
     pricesTfApiUrl: str
     pricesTfWebsocketUrl: str
@@ -227,9 +232,34 @@ class Options:
 
     steamApiKey: str
 
+    storageBackend: str
+    sqlitePath: str
+
     mongoUri: str
     mongoDb: str
     mongoCollection: str
+    mongoLayout: str
+
+    ingestQueueSize: int
+    ingestBatchSize: int
+    ingestFlushInterval: float
+    ingestWorkers: int
+    retainFullListings: bool
+    priceBatchSize: int
+    pricePushdown: bool
+    listingMaxAge: int
+    listingStore: bool
+    listingStoreMaxListings: int
+    listingRetention: bool
+    listingRetentionMargin: int
+    changeStream: bool
+    nodeId: str
+    pruneBatchSize: int
+    pruneInterval: float
+    snapshotConcurrency: int
+    snapshotRate: float
+    snapshotRetries: int
+    snapshotMaxAge: int
 
     minioEndpoint: str
     minioAccessKey: str
@@ -242,6 +272,7 @@ class Options:
 
     # JSON options
     jsonOptions: JsonOptions
+    flagRules: FlagRules
 
     logger = getLogger("Options")
 
@@ -256,6 +287,9 @@ class Options:
         self.backpackTfAccessToken = getOption("BACKPACK_TF_ACCESS_TOKEN", None, str)
         self.backpackTfSnapshotUrl = getOption("BACKPACK_TF_SNAPSHOT_URL", "https://backpack.tf/api/classifieds/listings/snapshot", str)
         self.backpackTfWebsocketUrl = getOption("BACKPACK_TF_WEBSOCKET_URL", "wss://ws.backpack.tf/events", str)
+        self.websocketJsonBackend = getOption("WEBSOCKET_JSON_BACKEND", "auto", str)
+        self.websocketLazyDecode = getOption("WEBSOCKET_LAZY_DECODE", "auto", lambda value: value if value == "auto" else loads(value))
+        self.resyncMaxItems = getOption("RESYNC_MAX_ITEMS", 300, int)  # Resynced ahead of the scheduler after a websocket gap
 
         self.pricesTfApiUrl = getOption("PRICES_TF_API_URL", "https://api2.prices.tf", str)
         self.pricesTfWebsocketUrl = getOption("PRICES_TF_WEBSOCKET_URL", "wss://ws.prices.tf", str)
@@ -265,9 +299,34 @@ class Options:
 
         self.steamApiKey = getOption("STEAM_API_KEY", "", str)
 
-        self.mongoUri = getOption("MONGO_URI", None, str)
+        self.storageBackend = getOption("STORAGE_BACKEND", "mongo", str)
+        self.sqlitePath = getOption("SQLITE_PATH", "nekopricer.db", str)
+
+        self.mongoUri = getOption("MONGO_URI", "", str)  # Required by the mongo backend
         self.mongoDb = getOption("MONGO_DB", "backpacktf", str)
         self.mongoCollection = getOption("MONGO_COLLECTION", "listings", str)
+        self.mongoLayout = getOption("MONGO_LAYOUT", "embedded", str)
+
+        self.ingestQueueSize = getOption("INGEST_QUEUE_SIZE", 10000, int)
+        self.ingestBatchSize = getOption("INGEST_BATCH_SIZE", 500, int)
+        self.ingestFlushInterval = getOption("INGEST_FLUSH_INTERVAL", 1.0, float)
+        self.ingestWorkers = getOption("INGEST_WORKERS", 0, int)
+        self.retainFullListings = getOption("RETAIN_FULL_LISTINGS", False, loads)
+        self.priceBatchSize = getOption("PRICE_BATCH_SIZE", 100, int)
+        self.pricePushdown = getOption("PRICE_PUSHDOWN", False, loads)
+        self.listingMaxAge = getOption("LISTING_MAX_AGE", 172800, int)  # 2 days
+        self.listingStore = getOption("LISTING_STORE", False, loads)
+        self.listingStoreMaxListings = getOption("LISTING_STORE_MAX_LISTINGS", 500000, int)
+        self.listingRetention = getOption("LISTING_RETENTION", False, loads)
+        self.listingRetentionMargin = getOption("LISTING_RETENTION_MARGIN", 10, int)  # Kept past buyLimit / sellLimit
+        self.changeStream = getOption("CHANGE_STREAM", False, loads)
+        self.nodeId = getOption("NODE_ID", gethostname(), str)
+        self.pruneBatchSize = getOption("PRUNE_BATCH_SIZE", 50, int)
+        self.pruneInterval = getOption("PRUNE_INTERVAL", 1.0, float)
+        self.snapshotConcurrency = getOption("SNAPSHOT_CONCURRENCY", 4, int)
+        self.snapshotRate = getOption("SNAPSHOT_RATE", 1.0, float)  # Requests per second, lowered for a while after a 429
+        self.snapshotRetries = getOption("SNAPSHOT_RETRIES", 3, int)
+        self.snapshotMaxAge = getOption("SNAPSHOT_MAX_AGE", 3600, int)  # Refreshed at startup when older, 0 refreshes everything
 
         self.minioEndpoint = getOption("MINIO_ENDPOINT", None, str)
         self.minioAccessKey = getOption("MINIO_ACCESS_KEY", None, str)
@@ -279,6 +338,7 @@ class Options:
         self.port = getOption("PORT", 3456, int)
 
         self.jsonOptions = DEFAULTS
+        self.flagRules = FlagRules(self.jsonOptions)
 
     def loadOptions(self):
         try:
@@ -288,10 +348,22 @@ class Options:
             jsonOptions = loads(self.pricer.minio.read_file("options.json"))
             validate(jsonOptions, options_schema)
             self.jsonOptions.update(jsonOptions)
+            self.flagRules = FlagRules(self.jsonOptions)
             self.logger.info("Loaded options.")
         except Exception as e:
             self.logger.error(f"Failed to load options: {e}")
 
+    # Options posted to the API replace the current ones only once they validate
+    def setOptions(self, jsonOptions: dict) -> bool:
+        try:
+            validate(jsonOptions, options_schema)
+        except ValidationError as e:
+            self.logger.error(f"Rejected options: {e.message}")
+            return False
+        self.jsonOptions = jsonOptions
+        self.saveOptions()
+        return True
+
     def saveOptions(self):
         try:
             validate(self.jsonOptions, options_schema)
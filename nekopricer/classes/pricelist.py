@@ -19,6 +19,7 @@ class Pricelist:
     logger = getLogger("Pricelist")
 
     item_list: list = []
+    item_names: set = set()  # Index of item_list names for O(1) lookups
     external_pricelist: list = []
     pricelist: list = []
     old_pricelist: list = []
@@ -52,6 +53,7 @@ class Pricelist:
             item_list = loads(self.pricer.minio.read_file("item-list.json"))
             validate(item_list, item_list_schema)
             self.item_list = item_list["items"]
+            self.item_names = {item["name"] for item in self.item_list}
             self.logger.info("Read item list.")
         except Exception as e:
             self.logger.error(f"Failed to read item list: {e}")
@@ -212,15 +214,18 @@ class Pricelist:
         self.logger.debug("Freezed pricelist.")
 
     def add_item(self, name: str) -> bool:
-        for item in self.item_list:
-            if item["name"] == name:
-                self.logger.warning(f"{name} is already in the item list.")
-                return False
-        else:
-            self.item_list.append({"name": name})
-            self.logger.info(f"Added {name} to the item list.")
-            self.write_item_list()
-            return True
+        if name in self.item_names:
+            self.logger.warning(f"{name} is already in the item list.")
+            return False
+        self.item_list.append({"name": name})
+        self.item_names.add(name)
+        self.pricer.snapshots.scheduler.add(name)
+        self.logger.info(f"Added {name} to the item list.")
+        self.write_item_list()
+        return True
+
+    def is_tracked(self, name: str) -> bool:
+        return name in self.item_names
 
     def get_item(self, name: str) -> dict:  # This will probably be useful in the future
         for item in self.item_list:
@@ -234,6 +239,10 @@ class Pricelist:
         for item in self.item_list:
             if item["name"] == name:
                 self.item_list.remove(item)
+                self.item_names.discard(name)
+                if self.pricer.store:
+                    self.pricer.store.remove(name)
+                self.pricer.snapshots.scheduler.remove(name)
                 self.logger.info(f"Removed {name} from the item list.")
                 self.write_item_list()
                 return True
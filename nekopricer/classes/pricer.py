@@ -5,11 +5,16 @@ from ..library.minio import MinIO
 from .options import Options
 from .server import Server
 from .tokens import Tokens
-from .database import Database
+from .database import open_database
 from .pricelist import Pricelist
 from .websocket import Websocket
+from .shards import Shards
+from .store import ListingStore
+from .retention import Retention
+from .watcher import Watcher
 from .snapshots import Snapshots
 from ..library.currencies import Currencies
+from ..library.listings import FlagRules
 from time import time, sleep
 from threading import Thread
 
@@ -35,9 +40,15 @@ class Pricer:
 
         self.price_items_thread = Thread(target=self.price_items_loop)
         self.price_items_thread.daemon = True
+        self.store_thread = Thread(target=lambda: self.store.start())
+        self.store_thread.daemon = True
 
-        self.database = Database(self)
+        self.database = open_database(self)
         self.websocket = Websocket(self)
+        self.shards = Shards(self, self.options.ingestWorkers) if self.options.ingestWorkers > 0 else None
+        self.store = self.create_store()
+        self.retention = self.create_retention()
+        self.watcher = Watcher(self) if self.store and self.options.changeStream and self.database.change_streams else None
         self.pricelist = Pricelist(self)
         self.snapshots = Snapshots(self)
         self.tokens = Tokens(self)
@@ -49,13 +60,69 @@ class Pricer:
         self.logger.info("Starting Pricer...")
         self.pricelist.start()
         self.tokens.read_tokens()
+        if self.store:
+            self.store_thread.start()  # Misses read through to Mongo until the bulk load is done
+        if self.watcher:
+            self.watcher.start()
         self.snapshots.start()
+        if self.shards:
+            self.shards.start()
         self.websocket.start()
         self.price_items_thread.start()
         self.server.start()
 
+    def create_store(self) -> ListingStore:
+        if not self.options.listingStore:
+            return None
+        if self.shards:
+            # Shard workers write from their own processes, this process would never see their writes
+            self.logger.warning("The listing store is disabled while INGEST_WORKERS is set.")
+            return None
+        return ListingStore(self, self.options.listingStoreMaxListings)
+
+    def create_retention(self) -> Retention:
+        if not self.options.listingRetention:
+            return None
+        if self.shards:
+            self.logger.warning("Listing retention only trims snapshots while INGEST_WORKERS is set.")
+        return Retention(self, self.options.listingRetentionMargin)
+
+    def options_changed(self):
+        # New flag rules apply to new listings right away, stored listings are derived again in the background.
+        # Only the blocked attributes and excluded descriptions change the flags, anything else leaves storage alone
+        flag_rules = FlagRules(self.options.jsonOptions)
+        if flag_rules.version == self.options.flagRules.version:
+            return
+        self.options.flagRules = flag_rules
+        if self.shards:
+            self.shards.options_changed(self.options.jsonOptions)
+        Thread(target=self.rederive_flags, args=(flag_rules,), daemon=True).start()
+
+    def rederive_flags(self, flag_rules: FlagRules):
+        if self.store:
+            self.logger.info(f"Derived flags again for {self.store.rederive(flag_rules)} stored listings in memory.")
+        item_names = list(self.pricelist.item_names)
+        rederived = 0
+        for name, listings in self.database.iter_listings(item_names, self.options.priceBatchSize):
+            if flag_rules is not self.options.flagRules:
+                self.logger.debug("Options changed again, stopping the previous flag re-derivation.")
+                return
+            # Listings stored before flags existed are left to FlagRules.ensure when they are read
+            updates = [
+                (name, listing.get("intent"), listing.get("steamid"), listing.get("bumped_at"), flag_rules.derive_options(listing))
+                for listing in listings["buy"] + listings["sell"]
+                if listing.get("flags_version") != flag_rules.version and "scrap" in listing
+            ]
+            try:
+                self.database.update_flags(updates)
+                rederived += len(updates)
+            except Exception as e:
+                self.logger.error(f"Failed to update flags for {name}: {e}")
+        self.logger.info(f"Derived flags again for {rederived} stored listings (Version: {flag_rules.version}).")
+
     def stop(self):
         self.logger.debug("Shutting down...")
+        self.websocket.database.close()
         self.database.close_connection()
 
     def price_items_loop(self):
@@ -74,13 +141,20 @@ class Pricer:
             self.statistics["total"] = len(skus)
             self.statistics["remaining"] = len(skus)
             items = [{"sku": sku, "name": name} for sku, name in zip(skus, items)]  # Create a compatable dict
-            for item in items:
+            # Listings come from the listing store, or are streamed in batches alongside the items instead of two reads per item
+            if self.options.pricePushdown:
+                prefetched = self.database.iter_top_listings([item["name"] for item in items], self.options.priceBatchSize, self.pushdown_criteria())
+            elif self.store:
+                prefetched = ((item["name"], self.store.get(item["name"])) for item in items)
+            else:
+                prefetched = self.database.iter_listings([item["name"] for item in items], self.options.priceBatchSize)
+            for item, (_, listings) in zip(items, prefetched):
                 try:
                     if item["sku"] == "5021;6":
                         self.statistics["remaining"] -= 1
                         self.statistics["fallback"] += 1
                         continue  # We don't price the key
-                    price = self.calculate_price(item)
+                    price = self.calculate_price(item, listings)
                     self.pricelist.update_price(price)
                     self.statistics["remaining"] -= 1
                     self.statistics["custom"] += 1
@@ -91,6 +165,7 @@ class Pricer:
                     self.logger.error(
                         f"({self.statistics["custom"] + self.statistics["fallback"]} / {self.statistics["total"]}) Failed to price {item["name"]}/{item["sku"]} using pricer: {e}"
                     )
+                    self.snapshots.scheduler.record(item["name"], "failures")
                     try:
                         price = self.pricelist.get_external_price(item)
                         price["fallback"] = e.args[0]  # Reason for fallback
@@ -112,11 +187,25 @@ class Pricer:
         except Exception as e:
             self.logger.error(f"Failed to price items: {e}")
 
+    def reprice_steamids(self, steamids: list[str]):
+        # Prices the items these steamids list right away instead of waiting for the next price_items pass
+        items = self.database.get_items_by_steamids(steamids)
+        names = sorted({name for names in items.values() for name in names if self.pricelist.is_tracked(name)})
+        self.logger.info(f"Repricing {len(names)} items listed by {len(steamids)} changed steamids.")
+        if not names:
+            return
+        skus = self.pricelist.to_sku_bulk(names) or []
+        # Like price_items the key is left alone, its price comes from the key refresh
+        for item in [{"sku": sku, "name": name} for sku, name in zip(skus, names) if sku and sku != "5021;6"]:
+            self.price_item(item)
+        self.pricelist.write_pricelist()
+
     def price_item(self, item: dict):
         try:
             if item["sku"] == "5021;6" and self.options.jsonOptions["enforceKeyFallback"]:
                 raise Exception("Forcing key price to fallback according to options.")
-            item["name"] = self.pricelist.to_name(item["sku"])
+            if "name" not in item:
+                item["name"] = self.pricelist.to_name(item["sku"])
             price = self.calculate_price(item)
             if item["sku"] == "5021;6":
                 self.pricelist.key_price = price
@@ -125,6 +214,7 @@ class Pricer:
         except Exception as e:
             if not item["sku"] == "5021;6":
                 self.logger.error(f"Failed to price {item["name"]}/{item["sku"]} using pricer: {e}")
+                self.snapshots.scheduler.record(item["name"], "failures")
             price = self.pricelist.get_external_price(item)
             if price is None:
                 self.logger.error(f"Failed to price {item["name"]}/{item["sku"]} using fallback.")
@@ -134,60 +224,56 @@ class Pricer:
             self.pricelist.emit_price(price)
             self.logger.info(f"Priced {item["name"]}/{item["sku"]} using fallback.")
 
-    def calculate_price(self, item: dict) -> dict:
+    # The options stage 1 of calculate_price depends on, for Database.iter_top_listings and Retention
+    def pushdown_criteria(self) -> dict:
+        options = self.options.jsonOptions
+        pricing_options = options["pricingOptions"]
+        return {
+            "excluded_steamids": options["excludedSteamIDs"],
+            "paints": options["paints"],
+            "only_bots": {
+                "buy": pricing_options["onlyBots"] and not pricing_options["buyHumanFallback"],
+                "sell": pricing_options["onlyBots"] and not pricing_options["sellHumanFallback"],
+            },
+            "limits": {"buy": pricing_options["buyLimit"], "sell": pricing_options["sellLimit"]},
+            "key_scrap": Currencies.toScrap(self.pricelist.key_price["buy"]["metal"]),
+            "version": self.options.flagRules.version,
+        }
+
+    def calculate_price(self, item: dict, listings: dict = None) -> dict:
         options = self.options.jsonOptions
-        buy_listings = self.database.get_listings_by_intent(item["name"], "buy")
-        sell_listings = self.database.get_listings_by_intent(item["name"], "sell")
+        if listings is None:
+            listings = self.store.get(item["name"]) if self.store else self.database.get_pricing_listings(item["name"])
+        # Flags are derived when listings are stored, only listings from before an options change are derived here
+        flag_rules = self.options.flagRules
+        buy_listings = [flag_rules.ensure(listing) for listing in listings["buy"]]
+        sell_listings = [flag_rules.ensure(listing) for listing in listings["sell"]]
         # Stage 1 - Filtering
         # 1. Remove excluded steam ids
-        buy_listings = [listing for listing in buy_listings if listing["steamid"] not in options["excludedSteamIDs"]]
-        sell_listings = [listing for listing in sell_listings if listing["steamid"] not in options["excludedSteamIDs"]]
+        excluded_steamids = set(options["excludedSteamIDs"])
+        buy_listings = [listing for listing in buy_listings if listing["steamid"] not in excluded_steamids]
+        sell_listings = [listing for listing in sell_listings if listing["steamid"] not in excluded_steamids]
         # 2. Remove humans
         if options["pricingOptions"]["onlyBots"]:  # Filter out humans or use humans if we don't have any bots
-            buy_listings_filtered = [listing for listing in buy_listings if listing["user_agent"] is not None]
-            sell_listings_filtered = [listing for listing in sell_listings if listing["user_agent"] is not None]
+            buy_listings_filtered = [listing for listing in buy_listings if listing["is_bot"]]
+            sell_listings_filtered = [listing for listing in sell_listings if listing["is_bot"]]
             # 2.5. Use humans if no bots were found
             if not len(buy_listings_filtered) == 0 and not options["pricingOptions"]["buyHumanFallback"]:
                 buy_listings = buy_listings_filtered
             if not len(sell_listings_filtered) == 0 and not options["pricingOptions"]["sellHumanFallback"]:
                 sell_listings = sell_listings_filtered
         # 3. Remove excluded listing descriptions
-        buy_listings = [
-            listing for listing in buy_listings if all(excluded not in listing["details"] for excluded in options["excludedListingDescriptions"])
-        ]
-        sell_listings = [
-            listing for listing in sell_listings if all(excluded not in listing["details"] for excluded in options["excludedListingDescriptions"])
-        ]
         # 4. Remove marketplace.tf listings
-        buy_listings = [listing for listing in buy_listings if "usd" not in listing["currencies"]]
-        sell_listings = [listing for listing in sell_listings if "usd" not in listing["currencies"]]
+        buy_listings = [listing for listing in buy_listings if not listing["excluded"] and not listing["has_usd"]]
+        sell_listings = [listing for listing in sell_listings if not listing["excluded"] and not listing["has_usd"]]
         # 5. Sort from lowest to high and highest to low
-        buy_listings = sorted(
-            buy_listings,
-            key=lambda x: Currencies(x["currencies"]).toValue(self.pricelist.key_price["buy"]["metal"]),
-            reverse=True,
-        )
-        sell_listings = sorted(
-            sell_listings,
-            key=lambda x: Currencies(x["currencies"]).toValue(self.pricelist.key_price["buy"]["metal"]),
-        )
+        key_scrap = Currencies.toScrap(self.pricelist.key_price["buy"]["metal"])
+        buy_listings = sorted(buy_listings, key=lambda x: x["scrap"] + x["keys"] * key_scrap, reverse=True)
+        sell_listings = sorted(sell_listings, key=lambda x: x["scrap"] + x["keys"] * key_scrap)
         # 6. Remove block attributes
         if item["name"] not in options["paints"]:
-            bad_listings = []
-            for listing in buy_listings:
-                if "attributes" in listing["item"]:
-                    for attribute in listing["item"]["attributes"]:
-                        for blocked_attribute in options["blockedAttributes"]:
-                            if str(attribute["defindex"]) == str(blocked_attribute["defindex"]):
-                                bad_listings.append(listing)
-            for listing in sell_listings:
-                if "attributes" in listing["item"]:
-                    for attribute in listing["item"]["attributes"]:
-                        for blocked_attribute in options["blockedAttributes"]:
-                            if str(attribute["defindex"]) == str(blocked_attribute["defindex"]):
-                                bad_listings.append(listing)
-            buy_listings = [listing for listing in buy_listings if listing not in bad_listings]
-            sell_listings = [listing for listing in sell_listings if listing not in bad_listings]
+            buy_listings = [listing for listing in buy_listings if not listing["blocked"]]
+            sell_listings = [listing for listing in sell_listings if not listing["blocked"]]
         # Stage 2 - Listing length check
         if len(buy_listings) == 0:
             raise Exception("No buy listings were found.")
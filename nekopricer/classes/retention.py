@@ -0,0 +1,121 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+
+from logging import getLogger
+from threading import Lock
+from time import time
+from ..library.telemetry import Telemetry
+
+INTENTS = ("buy", "sell")
+
+
+class Retention:
+    # Keeps a bounded window of listings per item and intent, the best buyLimit / sellLimit listings
+    # stage 1 of the pricer would pick plus a margin, so busy items don't grow without bound.
+    # Listings outside the window are only brought back by the next snapshot of the item.
+    logger = getLogger("Retention")
+
+    def __init__(self, pricer: "Pricer", margin: int):
+        self.pricer = pricer
+        self.margin = max(margin, 1)  # At least one past the limit, so the strict limit checks still see too many listings
+
+        # Items are trimmed at most once per price interval, written items wait in pending until they are due
+        self.lock = Lock()
+        self.trimmed: dict[str, float] = dict()
+        self.pending: set[str] = set()
+        self.telemetry = Telemetry()
+
+    def criteria(self) -> dict:
+        if not self.pricer.pricelist.key_price:
+            return None  # No key price yet, nothing can be ranked
+        return self.pricer.pushdown_criteria()
+
+    def rank(self, name: str, intent: str, listings: list, criteria: dict, min_time: float) -> list:
+        # The order stage 1 of calculate_price would use them in. Excluded steamids are dropped before anything else,
+        # then bots come first when humans are filtered out, usable listings before the ones stage 1 drops, then by
+        # value, best first
+        flag_rules = self.pricer.options.flagRules
+        excluded_steamids = set(criteria["excluded_steamids"])
+        check_blocked = name not in criteria["paints"]
+        only_bots = criteria["only_bots"][intent]
+        direction = -1 if intent == "buy" else 1
+
+        def key(listing: dict) -> tuple:
+            flags = flag_rules.ensure(listing)
+            unusable = (
+                flags["excluded"]
+                or flags["has_usd"]
+                or (check_blocked and flags["blocked"])
+                or (listing.get("bumped_at") or listing.get("listed_at") or min_time) < min_time
+            )
+            return (
+                listing.get("steamid") in excluded_steamids,
+                only_bots and not flags["is_bot"],
+                unusable,
+                direction * (flags["scrap"] + flags["keys"] * criteria["key_scrap"]),
+            )
+
+        return sorted(listings, key=key)
+
+    def select(self, name: str, listings: dict, criteria: dict) -> list[tuple[str, str]]:
+        # The (intent, steamid) pairs of {"buy": [...], "sell": [...]} that fall outside the window
+        min_time = time() - self.pricer.options.listingMaxAge
+        dropped = list()
+        for intent in INTENTS:
+            window = criteria["limits"][intent] + self.margin
+            ranked = self.rank(name, intent, listings.get(intent, []), criteria, min_time)
+            dropped.extend((intent, listing.get("steamid")) for listing in ranked[window:])
+        return dropped
+
+    def trim_snapshot(self, name: str, listings: list) -> list:
+        # The listings of a fresh snapshot, trimmed before they are written
+        criteria = self.criteria()
+        if criteria is None:
+            return listings
+        dropped = set(
+            self.select(name, {intent: [listing for listing in listings if listing.get("intent") == intent] for intent in INTENTS}, criteria)
+        )
+        if not dropped:
+            return listings
+        self.telemetry.increment("trimmed", len(dropped))
+        return [listing for listing in listings if (listing.get("intent"), listing.get("steamid")) not in dropped]
+
+    def due(self, names: list[str]) -> list[str]:
+        # Items are only priced once per interval, trimming them more often reads more without changing a price
+        now = time()
+        interval = self.pricer.options.jsonOptions["intervals"]["price"]
+        with self.lock:
+            self.pending.update(names)
+            due = [name for name in self.pending if now - self.trimmed.get(name, 0) >= interval]
+            for name in due:
+                self.pending.discard(name)
+                self.trimmed[name] = now
+        return due
+
+    def trim(self, names: list[str]) -> int:
+        # Items written by an ingestion flush, the listings that fell out of the window are deleted in one batch
+        criteria = self.criteria()
+        if criteria is None:
+            return 0
+        names = self.due(names)
+        if not names:
+            return 0
+        batch = {"delete": list()}
+        for name, listings in self.pricer.database.iter_listings(names, self.pricer.options.priceBatchSize):
+            dropped = self.select(name, listings, criteria)
+            batch["delete"].extend({"name": name, "intent": intent, "steamid": steamid} for intent, steamid in dropped)
+        if not batch["delete"]:
+            return 0
+        self.pricer.database.update_many(batch)
+        if self.pricer.store:
+            self.pricer.store.apply(batch)
+        self.telemetry.increment("trimmed", len(batch["delete"]))
+        return len(batch["delete"])
+
+    def get_statistics(self) -> dict:
+        statistics = self.telemetry.get_statistics()
+        statistics["margin"] = self.margin
+        statistics["pending"] = len(self.pending)
+        return statistics
@@ -0,0 +1,163 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+
+from logging import getLogger
+from collections import defaultdict
+from heapq import heapify, heappop, heappush
+from threading import Condition
+from time import time
+
+DEMAND_WEIGHTS = {
+    "hits": 1.0,  # /items/<sku> requests
+    "churn": 0.1,  # Websocket events
+    "failures": 2.0,  # Items the pricer had to fall back on
+}
+MAX_WAIT = 1  # Seconds a worker waits before looking again, picks up resyncs and new items
+
+
+class SnapshotScheduler:
+    # Orders snapshot refreshes by staleness weighted by demand. An item is due intervals.snapshot seconds
+    # after its last snapshot, divided by 1 + the demand it saw since then, so busy and failing items come
+    # around sooner. Entries in the heap are never updated in place, a newer entry for the same item makes
+    # the older one stale and it is skipped when it comes up.
+    logger = getLogger("SnapshotScheduler")
+
+    def __init__(self, pricer: "Pricer"):
+        self.pricer = pricer
+
+        self.condition = Condition()
+        self.heap: list[tuple[float, int, str]] = list()
+        self.entries: dict[str, int] = dict()  # Item name to the sequence of its live heap entry
+        self.snapshot_times: dict[str, float] = dict()
+        self.demand: dict[str, float] = defaultdict(float)
+        self.pending: dict[str, float] = defaultdict(float)  # Demand recorded since the heap last looked at it
+        self.deadlines: dict[str, float] = dict()  # Due by then at the latest, set by a websocket resync
+        self.in_flight: set[str] = set()
+        self.sequence = 0
+
+    @property
+    def interval(self) -> float:
+        return self.pricer.options.jsonOptions["intervals"]["snapshot"]
+
+    def due_at(self, name: str) -> float:
+        due_at = self.snapshot_times.get(name, 0) + self.interval / (1 + self.demand.get(name, 0))
+        return min(due_at, self.deadlines.get(name, due_at))
+
+    def push(self, name: str):
+        # Callers hold the condition
+        self.sequence += 1
+        self.entries[name] = self.sequence
+        heappush(self.heap, (self.due_at(name), self.sequence, name))
+
+    def load(self, item_names: set, snapshot_times: dict):
+        with self.condition:
+            self.snapshot_times = {name: snapshot_times.get(name, 0) for name in item_names}
+            self.heap = list()
+            self.entries.clear()
+            for name in item_names:
+                self.sequence += 1
+                self.entries[name] = self.sequence
+                self.heap.append((self.due_at(name), self.sequence, name))
+            heapify(self.heap)
+            self.condition.notify_all()
+        self.logger.info(f"Scheduled {len(item_names)} items.")
+
+    def add(self, name: str):
+        with self.condition:
+            if name in self.entries or name in self.in_flight:
+                return
+            self.snapshot_times.setdefault(name, 0)
+            self.push(name)
+            self.condition.notify()
+
+    def remove(self, name: str):
+        with self.condition:
+            self.entries.pop(name, None)  # The heap entry goes stale
+            self.snapshot_times.pop(name, None)
+            self.demand.pop(name, None)
+            self.pending.pop(name, None)
+            self.deadlines.pop(name, None)
+
+    def resync(self, names: list[str], requested_at: float):
+        # Items that may have missed websocket events are due at requested_at, behind the items that were already
+        # overdue and in the order given. They are refreshed at the normal rate, demand still comes first
+        with self.condition:
+            for name in names:
+                if name not in self.snapshot_times or self.snapshot_times[name] >= requested_at:
+                    continue
+                self.deadlines[name] = requested_at
+                if name in self.entries:
+                    self.push(name)
+            self.condition.notify_all()
+
+    def record(self, name: str, kind: str, amount: int = 1):
+        # Cheap enough for every websocket event, the heap only sees it on the next pop
+        with self.condition:
+            self.pending[name] += DEMAND_WEIGHTS[kind] * amount
+
+    def apply_pending(self):
+        for name, demand in self.pending.items():
+            if name not in self.snapshot_times:
+                continue  # Not tracked
+            self.demand[name] += demand
+            if name in self.entries:
+                self.push(name)
+        self.pending.clear()
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            # Mostly stale entries, rebuild from the live ones
+            self.heap = [entry for entry in self.heap if self.entries.get(entry[2]) == entry[1]]
+            heapify(self.heap)
+
+    def pop(self) -> str:
+        # The most overdue item, or None after MAX_WAIT if nothing is due yet
+        with self.condition:
+            self.apply_pending()
+            while self.heap:
+                due_at, sequence, name = self.heap[0]
+                if self.entries.get(name) != sequence:
+                    heappop(self.heap)
+                    continue
+                wait = due_at - time()
+                if wait > 0:
+                    self.condition.wait(min(wait, MAX_WAIT))
+                    return None
+                heappop(self.heap)
+                del self.entries[name]
+                self.in_flight.add(name)
+                return name
+            self.condition.wait(MAX_WAIT)
+            return None
+
+    def completed(self, name: str, snapshot_time: float):
+        with self.condition:
+            self.in_flight.discard(name)
+            if name not in self.snapshot_times:
+                return  # Removed while it was being fetched
+            self.snapshot_times[name] = snapshot_time
+            self.demand.pop(name, None)
+            self.pending.pop(name, None)
+            self.deadlines.pop(name, None)
+            self.push(name)
+
+    def failed(self, name: str):
+        # Counted as refreshed now, so it comes around again after an interval instead of spinning on an
+        # item backpack.tf won't serve
+        with self.condition:
+            self.in_flight.discard(name)
+            if name not in self.snapshot_times:
+                return
+            self.snapshot_times[name] = time()
+            self.deadlines.pop(name, None)
+            self.push(name)
+
+    def get_statistics(self) -> dict:
+        with self.condition:
+            now = time()
+            return {
+                "scheduled": len(self.entries),
+                "in_flight": len(self.in_flight),
+                "due": sum(1 for name in self.entries if self.due_at(name) <= now),
+                "heap": len(self.heap),
+            }
@@ -4,6 +4,7 @@ if TYPE_CHECKING:
     from .pricer import Pricer
 
 from logging import getLogger
+from threading import Thread
 from flask import Flask, Request, request, Response
 from flask_socketio import SocketIO
 
@@ -37,6 +38,7 @@ class Server:
         self.app.delete("/tokens/<key>")(self.delete_token)
         self.app.get("/options")(self.get_options)
         self.app.post("/options")(self.set_options)
+        self.app.get("/steamids/<steamid>")(self.get_steamid)
         self.socket.on("connect")(self.on_connect)
         self.socket.on("disconnect")(self.on_disconnect)
         self.logger.debug("Registered all endpoints.")
@@ -57,6 +59,7 @@ class Server:
         try:
             price = self.pricer.pricelist.get_price(item)
             item["name"] = self.pricer.pricelist.to_name(item["sku"])
+            self.pricer.snapshots.scheduler.record(item["name"], "hits")
             if price is not None:  # Item is priced, refresh price
                 self.pricer.price_item(item)  # Perform a price check
                 self.pricer.pricelist.add_item(item["name"])  # Ensure this item is in the item list
@@ -83,6 +86,11 @@ class Server:
             "item_list": {"total": len(self.pricer.pricelist.item_list)},
             "pricelist": self.pricer.pricelist.get_statistics(),
             "pricer": self.pricer.statistics,
+            "ingestion": self.pricer.websocket.get_statistics(),
+            "store": self.pricer.store.get_statistics() if self.pricer.store else None,
+            "watcher": self.pricer.watcher.get_statistics() if self.pricer.watcher else None,
+            "snapshots": self.pricer.snapshots.get_statistics(),
+            "retention": self.pricer.retention.get_statistics() if self.pricer.retention else None,
         }
 
     def get_tokens(self):
@@ -118,10 +126,22 @@ class Server:
         if not self.api_authorize_operator(request):
             return Response(status=403)
         data = request.get_json()
-        self.pricer.options.jsonOptions = data
-        self.pricer.options.saveOptions()
+        excluded_steamids = set(self.pricer.options.jsonOptions["excludedSteamIDs"])
+        if not self.pricer.options.setOptions(data):
+            return Response(status=400)
+        self.pricer.options_changed()
+        # Steamids added to or removed from the exclusions only change the prices of the items they list
+        changed_steamids = sorted(excluded_steamids.symmetric_difference(self.pricer.options.jsonOptions["excludedSteamIDs"]))
+        if changed_steamids:
+            Thread(target=self.pricer.reprice_steamids, args=(changed_steamids,), daemon=True).start()
         return Response(status=200)
 
+    def get_steamid(self, steamid: str):
+        if not self.api_authorize_operator(request):
+            return Response(status=403)
+        items = self.pricer.database.get_items_by_steamids([steamid]).get(steamid, [])
+        return {"steamid": steamid, "items": items}
+
     # Sockets
     def on_connect(self, socket):
         if not self.socket_authorize_user(request, socket):
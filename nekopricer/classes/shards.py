@@ -0,0 +1,196 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+
+from logging import getLogger, basicConfig
+from asyncio import get_running_loop, run, sleep
+from collections import defaultdict
+from multiprocessing import get_context
+from queue import Empty, Full
+from threading import Thread
+from time import time
+from typing import Iterable
+from zlib import crc32
+from .database import AsyncDatabase, open_database
+from .ingestion import Ingestion
+from .options import Options
+from .websocket import Websocket
+from ..library.listings import FlagRules
+from ..library.telemetry import Telemetry
+
+SHARD_QUEUE_FRAMES = 100  # Frame slices buffered per worker before the reader waits
+METRICS_INTERVAL = 5
+OPTIONS_EVENT = "options"  # Sent through the shard queues, so it lands in order with the events around it
+
+
+class Shards:
+    logger = getLogger("Shards")
+
+    def __init__(self, pricer: "Pricer", workers: int):
+        self.pricer = pricer
+        self.workers = workers
+
+        # Spawned workers start clean instead of inheriting the parent's threads and Mongo client
+        self.context = get_context("spawn")
+        self.queues = [self.context.Queue(maxsize=SHARD_QUEUE_FRAMES) for _ in range(self.workers)]
+        self.metrics = self.context.Queue()
+        self.processes = [None] * self.workers
+        self.statistics = [dict() for _ in range(self.workers)]
+        self.restarts = 0
+
+        self.supervisor_thread = Thread(target=self.supervisor)
+        self.supervisor_thread.daemon = True
+
+    def start(self):
+        self.logger.debug(f"Starting {self.workers} ingestion workers...")
+        for index in range(self.workers):
+            self.spawn(index)
+        self.supervisor_thread.start()
+
+    def spawn(self, index: int):
+        # Workers don't read options.json, they start from the options of this process and follow options_changed
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.queues[index], self.metrics, self.pricer.options.jsonOptions),
+            name=f"Shard {index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+        self.logger.info(f"Started shard {index} (PID: {process.pid}).")
+
+    def shard(self, item_name: str) -> int:
+        # crc32 instead of hash() so an item maps to the same worker across restarts
+        return crc32(item_name.encode("utf-8")) % self.workers
+
+    async def dispatch(self, events: Iterable[tuple[str, dict]]):
+        # Split the frame by item name so every listing of an item is written by the same worker
+        shards = [list() for _ in range(self.workers)]
+        for event, data in events:
+            item_name = (data.get("item") or {}).get("name")
+            if not self.pricer.pricelist.is_tracked(item_name):
+                continue
+            self.pricer.websocket.record_activity(item_name)
+            self.pricer.snapshots.scheduler.record(item_name, "churn")
+            shards[self.shard(item_name)].append((event, data))
+
+        for index, shard in enumerate(shards):
+            if shard:
+                await self.put(index, shard)
+
+    async def put(self, index: int, events: list):
+        while True:
+            try:
+                self.queues[index].put_nowait(events)
+                return
+            except Full:
+                # Wait for the worker without blocking the event loop
+                self.pricer.websocket.telemetry.increment("backpressure")
+                await sleep(0.01)
+
+    def options_changed(self, json_options: dict):
+        # Called from the API thread, waiting on a full queue is fine there
+        for queue in self.queues:
+            queue.put([(OPTIONS_EVENT, json_options)])
+
+    def supervisor(self):
+        while True:
+            try:
+                index, statistics = self.metrics.get(timeout=1)
+                self.statistics[index] = statistics
+            except Empty:
+                pass
+
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    self.logger.error(f"Shard {index} exited with code {process.exitcode}, restarting...")
+                    self.restarts += 1
+                    self.spawn(index)
+
+    def get_statistics(self) -> dict:
+        totals = defaultdict(int)
+        rates = defaultdict(float)
+        for statistics in self.statistics:
+            for name, total in statistics.get("totals", dict()).items():
+                totals[name] += total
+            for name, rate in statistics.get("rates", dict()).items():
+                rates[name] += rate
+        return {
+            "workers": self.workers,
+            "restarts": self.restarts,
+            "totals": dict(totals),
+            "rates": {name: round(rate, 2) for name, rate in rates.items()},
+            "shards": [
+                {
+                    "alive": process.is_alive(),
+                    "pid": process.pid,
+                    "queue": statistics.get("queue", dict()),
+                    "percentiles": statistics.get("percentiles", dict()),
+                }
+                for process, statistics in zip(self.processes, self.statistics)
+            ],
+        }
+
+
+class ShardWorker:
+    # Runs in its own process, reformats, coalesces and writes the events of one shard
+    def __init__(self, index: int, events, metrics, json_options: dict):
+        self.index = index
+        self.events = events
+        self.metrics = metrics
+        self.logger = getLogger(f"Shard {index}")
+
+        self.options = Options(self)
+        self.set_options(json_options)
+        self.database = open_database(self)
+        self.store = None  # The listing store lives in the main process
+        self.retention = None  # Ranking needs the key price, which only the main process has
+        self.telemetry = Telemetry()
+        self.ingestion = Ingestion(self, AsyncDatabase(self.database), self.telemetry)
+
+    async def run(self):
+        self.ingestion.start()
+        loop = get_running_loop()
+        reported = time()
+        self.logger.info("Ready.")
+        while True:
+            try:
+                events = await loop.run_in_executor(None, self.events.get, True, 1)
+            except Empty:
+                events = list()
+
+            for event, data in events:
+                await self.handle_event(event, data)
+
+            if time() - reported >= METRICS_INTERVAL:
+                statistics = self.telemetry.get_statistics()
+                statistics["queue"] = self.ingestion.get_statistics()
+                self.metrics.put((self.index, statistics))
+                reported = time()
+
+    def set_options(self, json_options: dict):
+        self.options.jsonOptions = json_options
+        self.options.flagRules = FlagRules(json_options)
+        self.logger.debug(f"Using flag rules {self.options.flagRules.version}.")
+
+    async def handle_event(self, event: str, data: dict):
+        if event == OPTIONS_EVENT:
+            self.set_options(data)
+            return
+        item_name = data["item"]["name"]
+        match event:
+            case "listing-update":
+                listing_data = await Websocket.reformat_event(data, self.options.retainFullListings, self.options.flagRules)
+                if listing_data:
+                    await self.ingestion.put("insert", Websocket.insert_operation(item_name, listing_data))
+            case "listing-delete":
+                await self.ingestion.put("delete", Websocket.delete_operation(item_name, data.get("intent"), data.get("steamid")))
+            case _:
+                return
+
+
+def run_worker(index: int, events, metrics, json_options: dict):
+    options = Options(None)
+    basicConfig(level=options.loggingLevel, format="[ %(asctime)s ] [ %(levelname)s ] [ %(name)s ]: %(message)s")
+    run(ShardWorker(index, events, metrics, json_options).run())
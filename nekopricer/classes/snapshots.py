@@ -4,9 +4,20 @@ if TYPE_CHECKING:
     from .pricer import Pricer
 
 from logging import getLogger
-from threading import Thread
-from time import sleep
+from collections import deque
+from threading import Thread, Lock
+from time import time
 from requests import get
+from .scheduler import SnapshotScheduler
+from ..library.listings import FlagRules, project_listing
+from ..library.ratelimit import TokenBucket, parse_retry_after
+from ..library.telemetry import Telemetry
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float = None):
+        super().__init__(f"Rate limited (Retry after: {retry_after})")
+        self.retry_after = retry_after
 
 
 class Snapshots:
@@ -17,6 +28,16 @@ class Snapshots:
 
         self.snapshot_times = dict()
 
+        self.concurrency = self.pricer.options.snapshotConcurrency
+        self.retries = self.pricer.options.snapshotRetries
+        self.limiter = TokenBucket(self.pricer.options.snapshotRate)
+        self.telemetry = Telemetry()
+        self.scheduler = SnapshotScheduler(self.pricer)
+
+        # Items to refresh ahead of the normal rotation, in order, mapped to the time they were requested
+        self.resync_items: dict[str, float] = dict()
+        self.resync_lock = Lock()
+
         self.snapshot_worker_thread = Thread(target=self.snapshot_worker)
         self.snapshot_worker_thread.daemon = True
 
@@ -24,12 +45,20 @@ class Snapshots:
         self.logger.debug("Starting snapshot worker...")
         self.snapshot_worker_thread.start()
 
+    def get_statistics(self) -> dict:
+        statistics = self.telemetry.get_statistics()
+        statistics["limiter"] = self.limiter.get_statistics()
+        statistics["concurrency"] = self.concurrency
+        statistics["resync_pending"] = len(self.resync_items)
+        statistics["scheduler"] = self.scheduler.get_statistics()
+        return statistics
+
     @staticmethod
-    def reformat_event(payload: dict) -> dict:
+    def reformat_event(payload: dict, retain_full: bool = False, flag_rules: FlagRules = None) -> dict:
         if not payload:
             return dict()
 
-        return {
+        listing = {
             "steamid": payload.get("steamid"),
             "currencies": payload.get("currencies"),
             "trade_offers_preferred": payload.get("offers"),
@@ -42,45 +71,114 @@ class Snapshots:
             "details": payload.get("details"),
             "only_buyout": payload.get("buyout", True),
         }
+        return project_listing(listing, retain_full, flag_rules)
 
     def snapshot_worker(self):
-        self.logger.warning("Performing one time refresh of all items.")
+        # The only full read of the snapshot times, the scheduler keeps them up to date from here on
+        self.snapshot_times = self.pricer.database.get_all_snapshot_times()
+        self.scheduler.load(self.pricer.pricelist.item_names, self.snapshot_times)
+
+        # Only snapshots missing or older than SNAPSHOT_MAX_AGE hold up startup, oldest first, the fresh
+        # ones are already in the scheduler
+        min_time = time() - self.pricer.options.snapshotMaxAge
         item_names = [item["name"] for item in self.pricer.pricelist.item_list]
-        total = len(item_names)
-        completed = 0
-        # Snapshot everything, once
-        for item in item_names:
+        stale_items = sorted(
+            (name for name in item_names if self.snapshot_times.get(name, 0) < min_time), key=lambda name: self.snapshot_times.get(name, 0)
+        )
+        self.logger.warning(f"Refreshing {len(stale_items)} stale or missing snapshots, {len(item_names) - len(stale_items)} are fresh.")
+        self.refresh(stale_items, log_progress=True)
+
+        # Then whatever the scheduler finds most overdue, for as long as we run
+        self.refresh(None)
+
+    def refresh(self, item_names: list = None, log_progress: bool = False):
+        # Fetches up to SNAPSHOT_CONCURRENCY items at a time, paced by the limiter. Without item_names the
+        # workers take items from the scheduler and never return. Resyncs are picked up between items so
+        # they don't wait for the whole batch
+        pending = deque(item_names or [])
+        pending_lock = Lock()
+        progress = {"completed": 0, "total": len(pending)}
+
+        def next_item() -> tuple[str, float]:
+            resync = self.next_resync()
+            if resync:
+                return resync
+            if item_names is None:
+                return self.scheduler.pop(), None
+            with pending_lock:
+                return (pending.popleft(), None) if pending else (None, None)
+
+        def worker():
+            while True:
+                item, requested_at = next_item()
+                if item is None:
+                    if item_names is None:
+                        continue  # Nothing due yet
+                    return
+                refreshed = self.fetch(item)
+                if requested_at is not None:
+                    if refreshed:
+                        self.logger.info(f"Resynced snapshot for {item} ({len(self.resync_items)} remaining)")
+                    continue
+                with pending_lock:
+                    progress["completed"] += 1
+                    completed = progress["completed"]
+                if refreshed and log_progress:
+                    self.logger.info(f"({completed} / {progress["total"]}) Refresh snapshot for {item}")
+                elif refreshed:
+                    self.logger.info(f"Refreshed snapshot for {item}")
+
+        workers = [Thread(target=worker, name=f"Snapshots {index}", daemon=True) for index in range(self.concurrency)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+    def fetch(self, item_name: str) -> bool:
+        # Rate limited items go back to the limiter until they get through, other failures are retried a few times
+        attempts = 0
+        while True:
+            self.limiter.acquire()
+            self.telemetry.increment("requests")
             try:
-                self.update_snapshot(item)
-                self.logger.info(f"({completed} / {total}) Refresh snapshot for {item}")
-                completed += 1
+                snapshot_time = self.update_snapshot(item_name)
+                self.limiter.succeed()
+                self.telemetry.increment("refreshed")
+                self.scheduler.completed(item_name, snapshot_time or time())
+                return True
+            except RateLimited as e:
+                self.telemetry.increment("rate_limited")
+                self.limiter.throttle(e.retry_after)
+                self.logger.warning(f"Recieved error code 429 from backpack.tf, slowing down to {self.limiter.rate:.2f} requests per second.")
             except Exception as e:
-                completed += 1
-                self.logger.error(f"({completed} / {total}) Failed to refresh snapshot for {item}: {e}")
-            sleep(1)
-        sleep(1)
-
+                attempts += 1
+                if attempts > self.retries:
+                    self.telemetry.increment("failed")
+                    self.scheduler.failed(item_name)
+                    self.logger.error(f"Failed to refresh snapshot for {item_name}: {e}")
+                    return False
+                self.telemetry.increment("retries")
+                self.logger.debug(f"Failed to refresh snapshot for {item_name}, retrying ({attempts} / {self.retries}): {e}")
+
+    def request_resync(self, item_names: list, requested_at: float):
+        with self.resync_lock:
+            for item_name in item_names:
+                self.resync_items.setdefault(item_name, requested_at)
+            pending = len(self.resync_items)
+        self.logger.info(f"Queued {len(item_names)} items for a snapshot resync ({pending} pending).")
+
+    def next_resync(self) -> tuple[str, float]:
         while True:
-            self.snapshot_times = self.pricer.database.get_all_snapshot_times()
-            item_names = [item["name"] for item in self.pricer.pricelist.item_list]
-            oldest_items = sorted(
-                ((k, v) for k, v in self.snapshot_times.items() if k in item_names.copy()),
-                key=lambda x: x[1],
-            )
-            oldest_items = [item[0] for item in oldest_items][:10]
-            missing_items = [item for item in item_names if item not in set(self.snapshot_times)]
-            oldest_items.extend(missing_items)
-
-            for item in oldest_items:
-                try:
-                    self.update_snapshot(item)
-                    self.logger.info(f"Refreshed snapshot for {item}")
-                except Exception as e:
-                    self.logger.error(f"Failed to refresh snapshot for {item}: {e}")
-                sleep(1)
-            sleep(1)
-
-    def update_snapshot(self, item_name: str) -> None:
+            with self.resync_lock:
+                if not self.resync_items:
+                    return None
+                item = next(iter(self.resync_items))
+                requested_at = self.resync_items.pop(item)
+            if self.snapshot_times.get(item, 0) < requested_at:
+                return item, requested_at
+            # Already refreshed by the regular rotation
+
+    def update_snapshot(self, item_name: str) -> float:
         response = get(
             url=f"{self.pricer.options.backpackTfSnapshotUrl}",
             params={
@@ -91,10 +189,7 @@ class Snapshots:
         )
 
         if response.status_code == 429:
-            self.logger.warning("Recieved error code 429 from backpack.tf.")
-            self.logger.debug("Slowing down...")
-            sleep(5)
-            return
+            raise RateLimited(parse_retry_after(response.headers.get("Retry-After")))
 
         if response.status_code != 200:
             raise Exception(f"Recieved status code {response.status_code}")
@@ -111,23 +206,22 @@ class Snapshots:
         if not listings or not snapshot_time:
             return
 
-        operations = {"insert": list(), "delete": list()}
+        snapshot_listings = list()
 
         for listing in listings:
-            listing_data = self.reformat_event(listing)
+            listing_data = self.reformat_event(listing, self.pricer.options.retainFullListings, self.pricer.options.flagRules)
             if not listing_data:
                 continue
 
-            operations["insert"].append(
-                {
-                    "name": item_name,
-                    "intent": listing_data.get("intent"),
-                    "steamid": listing_data.get("steamid"),
-                    "listing_data": listing_data,
-                }
-            )
-
-        self.pricer.database.delete_item(item_name)
-        self.pricer.database.update_many(operations)
-        self.pricer.database.update_snapshot_time(item_name, snapshot_time)
+            snapshot_listings.append(listing_data)
+
+        if self.pricer.retention:
+            snapshot_listings = self.pricer.retention.trim_snapshot(item_name, snapshot_listings)
+
+        # Only the difference to the stored listings is written, the item never goes without listings
+        generation = self.pricer.store.generation if self.pricer.store else 0
+        listings = self.pricer.database.apply_snapshot(item_name, snapshot_listings, snapshot_time)
+        if self.pricer.store:
+            self.pricer.store.replace(item_name, listings, generation)
         self.snapshot_times[item_name] = snapshot_time
+        return snapshot_time
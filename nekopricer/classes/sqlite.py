@@ -0,0 +1,214 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+
+from logging import getLogger
+from json import dumps, loads
+from sqlite3 import Connection, connect
+from threading import Lock, local
+from time import time
+from typing import Iterator
+from .storage import Storage
+from ..library.listings import FLAG_FIELDS, attribute_defindexes, is_bot
+
+
+# The same fields as the Mongo pricing projection (database.pricing_fields)
+def pricing_fields(listing: dict) -> dict:
+    return {
+        "steamid": listing.get("steamid"),
+        "intent": listing.get("intent"),
+        "currencies": listing.get("currencies"),
+        "details": listing.get("details"),
+        "listed_at": listing.get("listed_at"),
+        "bumped_at": listing.get("bumped_at"),
+        "is_bot": is_bot(listing),
+        "attributes": attribute_defindexes(listing),
+        **{key: listing[key] for key in FLAG_FIELDS if key in listing},
+    }
+
+
+class SQLiteDatabase(Storage):
+    # Embedded storage for single box deployments and local benchmarks, one row per listing keyed on
+    # (name, intent, steamid) like the per-listing Mongo layout. WAL lets the pricer and API read while
+    # the websocket writes, every thread gets its own connection.
+    logger = getLogger("SQLiteDatabase")
+
+    def __init__(self, pricer: "Pricer"):
+        self.pricer = pricer
+        self.path = self.pricer.options.sqlitePath
+
+        self.local = local()
+        self.connections: list[Connection] = list()
+        self.connections_lock = Lock()
+
+    @property
+    def connection(self) -> Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = connect(self.path, timeout=30, check_same_thread=False)  # Closed from close_connection
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")  # Durable across process crashes, WAL is synced on checkpoints
+            self.local.connection = connection
+            with self.connections_lock:
+                self.connections.append(connection)
+        return connection
+
+    @staticmethod
+    def placeholders(values: list) -> str:
+        return ", ".join("?" * len(values))
+
+    @staticmethod
+    def active_at(listing_data: dict) -> float:
+        return listing_data.get("bumped_at") or listing_data.get("listed_at") or time()
+
+    def create_index(self):
+        with self.connection as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "name TEXT NOT NULL, intent TEXT NOT NULL, steamid TEXT NOT NULL, active_at REAL NOT NULL, data TEXT NOT NULL,"
+                " PRIMARY KEY (name, intent, steamid)) WITHOUT ROWID"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS listings_active_at ON listings (active_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS listings_steamid ON listings (steamid, name)")
+            connection.execute("CREATE TABLE IF NOT EXISTS snapshots (name TEXT PRIMARY KEY, snapshot_time REAL NOT NULL) WITHOUT ROWID")
+
+    def insert_listing(self, name: str, intent: str, steamid: str, listing_data: dict):
+        with self.connection as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+                (name, intent, steamid, self.active_at(listing_data), dumps(listing_data)),
+            )
+
+    def delete_listing(self, name: str, intent: str, steamid: str):
+        with self.connection as connection:
+            connection.execute("DELETE FROM listings WHERE name = ? AND intent = ? AND steamid = ?", (name, intent, steamid))
+
+    def update_many(self, listings_to_update: dict):
+        # One transaction per batch
+        with self.connection as connection:
+            connection.executemany(
+                "DELETE FROM listings WHERE name = ? AND intent = ? AND steamid = ?",
+                [(operation["name"], operation["intent"], operation["steamid"]) for operation in listings_to_update.get("delete", [])],
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        operation["name"],
+                        operation["intent"],
+                        operation["steamid"],
+                        self.active_at(operation["listing_data"]),
+                        dumps(operation["listing_data"]),
+                    )
+                    for operation in listings_to_update.get("insert", [])
+                ],
+            )
+
+    def delete_item(self, name: str):
+        with self.connection as connection:
+            connection.execute("DELETE FROM listings WHERE name = ?", (name,))
+            connection.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+
+    def prune_listings(self, names: list[str], min_time: float) -> int:
+        with self.connection as connection:
+            pruned = connection.execute(
+                f"DELETE FROM listings WHERE name IN ({self.placeholders(names)}) AND active_at < ? RETURNING name",
+                (*names, min_time),
+            ).fetchall()
+        return len(set(name for (name,) in pruned))
+
+    def update_flags(self, updates: list[tuple[str, str, str, float, dict]]):
+        with self.connection as connection:
+            connection.executemany(
+                "UPDATE listings SET data = json_patch(data, ?)"
+                " WHERE name = ? AND intent = ? AND steamid = ? AND json_extract(data, '$.bumped_at') IS ?",
+                [(dumps(flags), name, intent, steamid, bumped_at) for name, intent, steamid, bumped_at, flags in updates],
+            )
+
+    def apply_snapshot(self, name: str, listings: list, snapshot_time: float) -> list:
+        # One immediate transaction, so the diff is computed against what is written. Stored listings bumped
+        # after the snapshot was taken are kept, unchanged listings aren't written
+        with self.connection as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            rows = connection.execute("SELECT intent, steamid, active_at, data FROM listings WHERE name = ?", (name,))
+            stored = {(intent, steamid): (active_at, data) for intent, steamid, active_at, data in rows}
+            result = dict()
+            inserts = list()
+            updates = list()
+            for listing in listings:
+                key = (listing.get("intent"), listing.get("steamid"))
+                previous = stored.pop(key, None)
+                data = dumps(listing)
+                if previous is None:
+                    inserts.append((name, *key, self.active_at(listing), data))
+                elif previous[0] > snapshot_time:
+                    data = previous[1]
+                elif previous[1] != data:
+                    updates.append((self.active_at(listing), data, name, *key))
+                result[key] = data
+            deletes = list()
+            for key, (active_at, data) in stored.items():
+                if active_at > snapshot_time:
+                    result[key] = data
+                else:
+                    deletes.append((name, *key))
+            connection.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)", inserts)
+            connection.executemany("UPDATE listings SET active_at = ?, data = ? WHERE name = ? AND intent = ? AND steamid = ?", updates)
+            connection.executemany("DELETE FROM listings WHERE name = ? AND intent = ? AND steamid = ?", deletes)
+            connection.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)", (name, snapshot_time))
+        return [loads(data) for data in result.values()]
+
+    def update_snapshot_time(self, name: str, snapshot_time: float):
+        with self.connection as connection:
+            connection.execute("INSERT OR REPLACE INTO snapshots VALUES (?, ?)", (name, snapshot_time))
+
+    def get_snapshot_time(self, name: str) -> float:
+        row = self.connection.execute("SELECT snapshot_time FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def get_all_snapshot_times(self) -> dict:
+        return dict(self.connection.execute("SELECT name, snapshot_time FROM snapshots"))
+
+    def get_listings_by_intent(self, name: str, intent: str) -> list:
+        rows = self.connection.execute("SELECT data FROM listings WHERE name = ? AND intent = ?", (name, intent))
+        return [loads(data) for (data,) in rows]
+
+    def get_listings(self, name: str) -> list:
+        return [loads(data) for (data,) in self.connection.execute("SELECT data FROM listings WHERE name = ?", (name,))]
+
+    def get_items_by_steamids(self, steamids: list[str]) -> dict:
+        items = dict()
+        rows = self.connection.execute(
+            f"SELECT DISTINCT steamid, name FROM listings WHERE steamid IN ({self.placeholders(steamids)}) ORDER BY steamid, name", steamids
+        )
+        for steamid, name in rows:
+            items.setdefault(steamid, list()).append(name)
+        return items
+
+    def get_pricing_listings(self, name: str) -> dict:
+        listings = {"buy": list(), "sell": list()}
+        for intent, data in self.connection.execute("SELECT intent, data FROM listings WHERE name = ? AND intent IN ('buy', 'sell')", (name,)):
+            listings[intent].append(pricing_fields(loads(data)))
+        return listings
+
+    def iter_listings(self, names: list[str], batch_size: int = 100) -> Iterator[tuple[str, dict]]:
+        for index in range(0, len(names), batch_size):
+            batch = names[index : index + batch_size]
+            listings = {name: {"buy": list(), "sell": list()} for name in batch}
+            rows = self.connection.execute(
+                f"SELECT name, intent, data FROM listings WHERE name IN ({self.placeholders(batch)}) AND intent IN ('buy', 'sell')",
+                batch,
+            )
+            for name, intent, data in rows:
+                listings[name][intent].append(loads(data))
+            for name in batch:
+                yield name, listings[name]
+
+    # iter_top_listings is the Storage default, reads are local so there is nothing to push down
+
+    def close_connection(self):
+        with self.connections_lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections.clear()
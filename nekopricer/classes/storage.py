@@ -0,0 +1,98 @@
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+
+class Storage(ABC):
+    # The listing storage used by Websocket, Snapshots, Pricer and the listing store. Database implements
+    # it on MongoDB, SQLiteDatabase on an embedded SQLite file. open_database picks one from STORAGE_BACKEND.
+    # Listings are addressed by (name, intent, steamid), listing_data is the projected listing dict.
+    # Abstract, so a backend missing a method fails when it is opened instead of deep in a pricing thread.
+
+    ttl_expiry = False  # Stale listings expire on their own, otherwise Websocket runs prune_listings
+    change_streams = False  # watch, decode_change and the resume tokens are available for the Watcher
+
+    @abstractmethod
+    def create_index(self):
+        raise NotImplementedError
+
+    def migrate(self) -> int:
+        return 0
+
+    # Writes
+    @abstractmethod
+    def insert_listing(self, name: str, intent: str, steamid: str, listing_data: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_listing(self, name: str, intent: str, steamid: str):
+        raise NotImplementedError
+
+    # {"insert": [{"name", "intent", "steamid", "listing_data"}], "delete": [{"name", "intent", "steamid"}]}
+    @abstractmethod
+    def update_many(self, listings_to_update: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_item(self, name: str):
+        raise NotImplementedError
+
+    # Replaces the listings of an item with a snapshot taken at snapshot_time and records the snapshot time,
+    # listings bumped after the snapshot are kept. Returns the listings the item has afterwards
+    @abstractmethod
+    def apply_snapshot(self, name: str, listings: list, snapshot_time: float) -> list:
+        raise NotImplementedError
+
+    # Drop listings last bumped (or listed) before min_time from a batch of items, returns the items touched
+    @abstractmethod
+    def prune_listings(self, names: list[str], min_time: float) -> int:
+        raise NotImplementedError
+
+    # Updates are (name, intent, steamid, bumped_at, flags) tuples, a listing is only updated while it still
+    # has the bumped_at the flags were derived from, so a newer write isn't stamped with stale flags
+    @abstractmethod
+    def update_flags(self, updates: list[tuple[str, str, str, float, dict]]):
+        raise NotImplementedError
+
+    # Snapshot times
+    @abstractmethod
+    def update_snapshot_time(self, name: str, snapshot_time: float):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_snapshot_time(self, name: str) -> float:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_all_snapshot_times(self) -> dict:
+        raise NotImplementedError
+
+    # Reads
+    @abstractmethod
+    def get_listings_by_intent(self, name: str, intent: str) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_listings(self, name: str) -> list:
+        raise NotImplementedError
+
+    # The items each steamid has listings for, {steamid: [name, ...]}, steamids without listings are left out
+    @abstractmethod
+    def get_items_by_steamids(self, steamids: list[str]) -> dict:
+        raise NotImplementedError
+
+    # Both intents of one item, projected to the fields Pricer.calculate_price reads
+    @abstractmethod
+    def get_pricing_listings(self, name: str) -> dict:
+        raise NotImplementedError
+
+    # (name, {"buy": [...], "sell": [...]}) in the order of names, batch_size items at a time
+    @abstractmethod
+    def iter_listings(self, names: list[str], batch_size: int = 100) -> Iterator[tuple[str, dict]]:
+        raise NotImplementedError
+
+    # Like iter_listings, may leave out listings stage 1 of the pricer would drop (see Pricer.pushdown_criteria)
+    def iter_top_listings(self, names: list[str], batch_size: int, criteria: dict) -> Iterator[tuple[str, dict]]:
+        return self.iter_listings(names, batch_size)
+
+    def close_connection(self):
+        pass
@@ -0,0 +1,174 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+
+from logging import getLogger
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from ..library.listings import FlagRules, pricing_listing
+from ..library.telemetry import Telemetry
+
+INTENTS = ("buy", "sell")
+
+
+class ListingStore:
+    # In-process copy of the listings of tracked items, keyed by item name, intent and steamid.
+    # Written through from the same paths that write to Mongo and read by the pricer without a round trip.
+    logger = getLogger("ListingStore")
+
+    def __init__(self, pricer: "Pricer", max_listings: int):
+        self.pricer = pricer
+        self.max_listings = max_listings
+
+        self.lock = Lock()
+        self.items: OrderedDict[str, dict[str, dict[str, dict]]] = OrderedDict()  # Least recently used first
+        self.listings = 0
+        self.telemetry = Telemetry()
+
+        # Every write stamps its items with a new generation, so a read-through or snapshot that started
+        # before the write doesn't put a copy the write never reached into the store
+        self.generation = 0
+        self.written: dict[str, int] = dict()
+
+    def start(self):
+        self.logger.debug(f"Loading listings (Cap: {self.max_listings})...")
+        item_names = list(self.pricer.pricelist.item_names)
+        batch_size = self.pricer.options.priceBatchSize
+        for index in range(0, len(item_names), batch_size):
+            generation = self.generation
+            for name, listings in self.pricer.database.iter_listings(item_names[index : index + batch_size], batch_size):
+                self.load(name, listings, generation)
+        self.logger.info(f"Loaded {self.listings} listings for {len(self.items)} items.")
+
+    def reload(self):
+        with self.lock:
+            self.items.clear()
+            self.listings = 0
+        self.start()
+
+    @staticmethod
+    def build_item(listings: dict) -> dict:
+        return {intent: {listing.get("steamid"): pricing_listing(listing) for listing in listings.get(intent, [])} for intent in INTENTS}
+
+    def load(self, name: str, listings: dict, generation: int):
+        with self.lock:
+            if self.written.get(name, 0) > generation:
+                return  # Written while we were reading, the next read loads it again
+            self.set_item(name, self.build_item(listings))
+
+    def set_item(self, name: str, item: dict):
+        previous = self.items.pop(name, None)
+        if previous:
+            self.listings -= sum(len(listings) for listings in previous.values())
+        self.items[name] = item
+        self.listings += sum(len(listings) for listings in item.values())
+        self.evict()
+
+    def get(self, name: str) -> dict:
+        min_time = time() - self.pricer.options.listingMaxAge
+        with self.lock:
+            item = self.items.get(name)
+            if item is not None:
+                self.items.move_to_end(name)
+                self.telemetry.increment("hits")
+                return {
+                    intent: [listing for listing in listings.values() if (listing.get("active_at") or min_time) >= min_time]
+                    for intent, listings in item.items()
+                }
+            generation = self.generation
+
+        # Read through and keep the item for the next cycle
+        self.telemetry.increment("misses")
+        listings = self.pricer.database.get_pricing_listings(name)
+        if self.pricer.pricelist.is_tracked(name):
+            self.load(name, listings, generation)
+        return listings
+
+    def apply(self, batch: dict):
+        # A flushed ingestion batch, called after the Mongo write succeeded
+        with self.lock:
+            self.generation += 1
+            for action, operations in batch.items():
+                for operation in operations:
+                    self.written[operation["name"]] = self.generation
+                    item = self.items.get(operation["name"])
+                    if item is None:
+                        continue
+                    listings = item.get(operation["intent"])
+                    if listings is None:
+                        continue
+                    self.listings -= operation["steamid"] in listings
+                    listings.pop(operation["steamid"], None)
+                    if action == "insert":
+                        listings[operation["steamid"]] = pricing_listing(operation["listing_data"])
+                        self.listings += 1
+            self.evict()
+
+    def replace(self, name: str, listings: list, generation: int = None):
+        # A fresh snapshot is the complete state of an item, unless a flush wrote to it after generation.
+        # Change streams replay writes in order and pass None
+        item = self.build_item({intent: [listing for listing in listings if listing.get("intent") == intent] for intent in INTENTS})
+        with self.lock:
+            if generation is not None and self.written.get(name, 0) > generation:
+                self.pop_item(name)  # Either copy could be missing a write, the next read loads it again
+                return
+            self.set_item(name, item)
+
+    def rederive(self, flag_rules: FlagRules) -> int:
+        # One item at a time, flushes applied from the websocket loop only ever wait for a single item
+        with self.lock:
+            names = list(self.items)
+        rederived = 0
+        for name in names:
+            if flag_rules is not self.pricer.options.flagRules:
+                break  # Options changed again, the newer pass takes over
+            with self.lock:
+                item = self.items.get(name)
+                if item is None:
+                    continue
+                for listings in item.values():
+                    for listing in listings.values():
+                        if listing.get("flags_version") != flag_rules.version:
+                            listing.update(flag_rules.derive(listing))
+                            rederived += 1
+        return rederived
+
+    def remove(self, name: str):
+        with self.lock:
+            if self.pop_item(name):
+                self.telemetry.increment("evictions")
+            self.written.pop(name, None)
+
+    def pop_item(self, name: str) -> dict:
+        # Callers hold the lock
+        item = self.items.pop(name, None)
+        if item:
+            self.listings -= sum(len(listings) for listings in item.values())
+        return item
+
+    def evict(self):
+        # Over the cap, untracked items go first, then the least recently used ones, down to 90% of the
+        # cap so a full store doesn't evict on every write
+        if self.listings <= self.max_listings:
+            return
+        target = self.max_listings * 0.9
+        untracked = [name for name in self.items if not self.pricer.pricelist.is_tracked(name)]
+        for name in untracked + list(self.items):
+            if self.listings <= target:
+                break
+            item = self.items.pop(name, None)
+            if item is not None:
+                self.listings -= sum(len(listings) for listings in item.values())
+                self.telemetry.increment("evictions")
+
+    def get_statistics(self) -> dict:
+        statistics = self.telemetry.get_statistics()
+        hits = statistics["totals"].get("hits", 0)
+        misses = statistics["totals"].get("misses", 0)
+        statistics["items"] = len(self.items)
+        statistics["listings"] = self.listings
+        statistics["max_listings"] = self.max_listings
+        statistics["hit_ratio"] = round(hits / (hits + misses), 4) if hits + misses else 0
+        return statistics
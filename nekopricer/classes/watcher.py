@@ -0,0 +1,81 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .pricer import Pricer
+
+from logging import getLogger
+from threading import Thread
+from time import time, sleep
+from pymongo.errors import OperationFailure, PyMongoError
+from ..library.telemetry import Telemetry
+
+RESUME_TOKEN_INTERVAL = 5  # Seconds between saving the resume token
+HISTORY_LOST_CODES = (280, 286)  # ChangeStreamFatalError, ChangeStreamHistoryLost
+
+
+class Watcher:
+    # Follows the listing collection through a change stream and patches the listing store with writes
+    # made by any node, so several pricers can share a collection and still serve from memory
+    logger = getLogger("Watcher")
+
+    def __init__(self, pricer: "Pricer"):
+        self.pricer = pricer
+        self.node = self.pricer.options.nodeId
+
+        self.telemetry = Telemetry()
+        self.resume_token: dict = None
+
+        self.watcher_thread = Thread(target=self.watch)
+        self.watcher_thread.daemon = True
+
+    def start(self):
+        self.logger.debug(f"Starting change stream watcher for node {self.node}...")
+        self.watcher_thread.start()
+
+    def watch(self):
+        self.resume_token = self.pricer.database.get_resume_token(self.node)
+        while True:
+            try:
+                with self.pricer.database.watch(self.resume_token) as stream:
+                    self.logger.info("Watching the listing collection" + (", resumed from the stored token." if self.resume_token else "."))
+                    saved = time()
+                    for change in stream:
+                        self.apply(change)
+                        self.resume_token = stream.resume_token
+                        if time() - saved >= RESUME_TOKEN_INTERVAL:
+                            self.pricer.database.set_resume_token(self.node, self.resume_token)
+                            saved = time()
+            except OperationFailure as e:
+                if e.code not in HISTORY_LOST_CODES:
+                    self.logger.error(f"Change stream failed: {e}")
+                    self.telemetry.increment("reconnects")
+                    sleep(3)
+                    continue
+                # The oplog moved past our token, changes were missed so the store is rebuilt from Mongo
+                self.logger.warning(f"Change stream can't resume ({e.code}), reloading the listing store.")
+                self.telemetry.increment("history_lost")
+                self.resume_token = None
+                self.pricer.store.reload()
+            except PyMongoError as e:
+                self.logger.error(f"Change stream disconnected: {e}")
+                self.telemetry.increment("reconnects")
+                sleep(3)
+
+    def apply(self, change: dict):
+        self.telemetry.increment("changes")
+        change = self.pricer.database.decode_change(change)
+        if change is None:
+            self.telemetry.increment("ignored")
+            return
+        if "replace" in change:
+            if self.pricer.pricelist.is_tracked(change["replace"]):
+                self.pricer.store.replace(change["replace"], change["listings"])
+            return
+        # Writes made by this node come back here too, applying them again is a no-op
+        self.pricer.store.apply(change)
+
+    def get_statistics(self) -> dict:
+        statistics = self.telemetry.get_statistics()
+        statistics["node"] = self.node
+        statistics["resumable"] = self.resume_token is not None
+        return statistics
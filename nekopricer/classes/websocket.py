@@ -4,16 +4,22 @@ if TYPE_CHECKING:
     from .pricer import Pricer
 
 from logging import getLogger
-from asyncio import Future, create_task, sleep, run
+from asyncio import Future, Task, create_task, sleep, run
 from websockets import (
     connect,
     ConnectionClosedError,
     ConnectionClosedOK,
     ConnectionClosed,
 )
-from json import loads
 from threading import Thread
-from time import time
+from time import time, perf_counter
+from .database import AsyncDatabase
+from .ingestion import Ingestion
+from ..library.decoder import Decoder
+from ..library.listings import FlagRules, project_listing
+from ..library.telemetry import Telemetry
+
+RESYNC_WINDOW = 300  # Items with events this many seconds before a disconnect are resynced first
 
 
 class Websocket:
@@ -22,6 +28,15 @@ class Websocket:
     def __init__(self, pricer: "Pricer"):
         self.pricer = pricer
 
+        self.telemetry = Telemetry()
+        self.activity: dict[str, float] = dict()  # Last event time per tracked item, orders resyncs
+        self.activity_swept = time()
+        self.disconnected_at: float = None
+        self.pruner_task: Task = None
+        self.database = AsyncDatabase(self.pricer.database)
+        self.ingestion = Ingestion(self.pricer, self.database, self.telemetry)
+        self.decoder = Decoder(self.pricer.options.websocketJsonBackend, self.pricer.options.websocketLazyDecode, self.telemetry)
+
         self.websocket_thread = Thread(target=lambda: run(self.start_websocket()))
         self.websocket_thread.daemon = True
 
@@ -30,11 +45,11 @@ class Websocket:
         self.websocket_thread.start()
 
     @staticmethod
-    async def reformat_event(payload: dict) -> dict:
+    async def reformat_event(payload: dict, retain_full: bool = False, flag_rules: FlagRules = None) -> dict:
         if not payload:
             return dict()
 
-        return {
+        listing = {
             "steamid": payload.get("steamid"),
             "currencies": payload.get("currencies"),
             "trade_offers_preferred": payload.get("tradeOffersPreferred"),
@@ -47,12 +62,34 @@ class Websocket:
             "details": payload.get("details"),
             "only_buyout": payload.get("buyout", True),
         }
+        return project_listing(listing, retain_full, flag_rules)
+
+    @staticmethod
+    def insert_operation(item_name: str, listing_data: dict) -> dict:
+        return {
+            "name": item_name,
+            "intent": listing_data.get("intent"),
+            "steamid": listing_data.get("steamid"),
+            "listing_data": listing_data,
+        }
+
+    @staticmethod
+    def delete_operation(item_name: str, intent: str, steamid: str) -> dict:
+        return {"name": item_name, "intent": intent, "steamid": steamid}
 
     async def start_websocket(self):
-        self.pricer.database.delete_old_listings(172800 + time())  # 2 days
+        # Move listings over from the embedded layout after switching MONGO_LAYOUT
+        await self.database.migrate()
 
         # Create index on name
-        self.pricer.database.create_index()
+        await self.database.create_index()
+
+        # Start the batching database writer on this event loop
+        self.ingestion.start()
+
+        # Layouts without a TTL index expire stale listings a few items at a time
+        if not self.pricer.database.ttl_expiry:
+            self.pruner_task = create_task(self.prune_listings())
 
         while True:
             try:
@@ -66,30 +103,78 @@ class Websocket:
                     await Future()
             except (ConnectionClosedError, ConnectionClosedOK, ConnectionClosed) as e:
                 self.logger.error(f"Websocket connection closed: {e}")
+                self.telemetry.increment("reconnects")
+                self.disconnected_at = self.disconnected_at or time()
                 self.logger.debug("Attempting to reconnect in 3 seconds...")
                 await sleep(3)
             except KeyboardInterrupt:
                 break
 
+    async def prune_listings(self):
+        while True:
+            item_names = list(self.pricer.pricelist.item_names)
+            batch_size = self.pricer.options.pruneBatchSize
+            for index in range(0, len(item_names), batch_size):
+                try:
+                    pruned = await self.database.prune_listings(item_names[index : index + batch_size], time() - self.pricer.options.listingMaxAge)
+                    self.telemetry.increment("pruned_items", pruned)
+                except Exception as e:
+                    self.logger.error(f"Failed to prune stale listings: {e}")
+                await sleep(self.pricer.options.pruneInterval)
+            if not item_names:
+                await sleep(self.pricer.options.pruneInterval)
+
     async def handle_websocket(self, websocket):
         self.logger.info("Connected to backpack.tf websocket!")
         listing_count = 0
 
+        if self.disconnected_at:
+            self.resync(self.disconnected_at, time())
+            self.disconnected_at = None
+
         async for message in websocket:
             self.logger.debug(f"Collected {listing_count} total events.")
 
-            json_data = loads(message)
+            start = perf_counter()
+            events = self.decoder.decode(message, self.pricer.pricelist.is_tracked)
+            self.telemetry.set("last_frame_at", time())
 
-            if isinstance(json_data, list):
-                create_task(self.handle_list_events(json_data))
-                self.logger.info(f"Recieved {len(json_data)} events.")
-                listing_count += len(json_data)
-            else:
-                create_task(self.handle_event(json_data, json_data.get("event")))
-                self.logger.info("Recieved 1 event.")
-                listing_count += 1
+            # Handled inline so a full ingestion queue slows down the reader instead of piling up tasks
+            await self.handle_list_events(events)
+            self.telemetry.observe("frame_latency", perf_counter() - start)
+            self.logger.info(f"Recieved {len(events)} events.")
+            listing_count += len(events)
         return
 
+    def record_activity(self, item_name: str):
+        now = time()
+        self.activity[item_name] = now
+        if now - self.activity_swept >= RESYNC_WINDOW:
+            # Items that went quiet or left the pricelist
+            self.activity = {name: at for name, at in self.activity.items() if now - at < RESYNC_WINDOW}
+            self.activity_swept = now
+
+    def resync(self, disconnected_at: float, reconnected_at: float):
+        # Every event during the gap is lost, so every tracked item is refreshed. The most recently active items most
+        # likely missed some, up to RESYNC_MAX_ITEMS of them are resynced ahead of the scheduler. The rest of the
+        # active items and then every other tracked item are made due in the scheduler, at its normal rate
+        gap = reconnected_at - disconnected_at
+        self.telemetry.increment("gaps")
+        self.telemetry.set("last_gap", gap)
+        since = disconnected_at - RESYNC_WINDOW
+        active = [(at, name) for name, at in list(self.activity.items()) if at >= since and self.pricer.pricelist.is_tracked(name)]
+        active = [name for _, name in sorted(active, reverse=True)]
+        first = active[: self.pricer.options.resyncMaxItems]
+        recent = set(active)
+        rest = active[len(first) :] + [name for name in self.pricer.pricelist.item_names if name not in recent]
+        self.telemetry.set("last_resync", len(first))
+        self.logger.warning(
+            f"Websocket was down for {gap:.1f} seconds, resyncing {len(first)} recently active items first and {len(rest)} more as scheduled."
+        )
+        if first:
+            self.pricer.snapshots.request_resync(first, reconnected_at)
+        self.pricer.snapshots.scheduler.resync(rest, reconnected_at)
+
     async def handle_event(self, data: dict, event: str):
         # If no data is provided, exit the function
         if not data:
@@ -97,9 +182,11 @@ class Websocket:
 
         item_name = data.get("item", dict()).get("name")
         # Don't save an item that isn't in our item list
-        item_names = [item["name"] for item in self.pricer.pricelist.item_list]
-        if item_name not in item_names:
+        if not self.pricer.pricelist.is_tracked(item_name):
+            self.telemetry.increment("filtered")
             return
+        self.record_activity(item_name)
+        self.pricer.snapshots.scheduler.record(item_name, "churn")
 
         # Depending on the event type, perform different actions
         match event:
@@ -119,68 +206,33 @@ class Websocket:
         return
 
     async def handle_list_events(self, events: list):
-        listings_to_update = {"insert": list(), "delete": list()}
-        for event in events:
-            data = event.get("payload", dict())
-            item_name = data.get("item", dict()).get("name")
-
-            # Don't add this item if its not in our item list
-            item_names = [item["name"] for item in self.pricer.pricelist.item_list]
-            if item_name not in item_names:
-                continue
-
-            if not data:
-                continue
-
-            match event.get("event"):
-                case "listing-update":
-                    listing_data = await self.reformat_event(data)
-                    if not listing_data:
-                        continue
-
-                    listings_to_update["insert"].append(
-                        {
-                            "name": item_name,
-                            "intent": listing_data.get("intent"),
-                            "steamid": listing_data.get("steamid"),
-                            "listing_data": listing_data,
-                        }
-                    )
-                    self.logger.debug(
-                        f"listing-update for {item_name} with intent {listing_data.get('intent')}" f" and steamid {listing_data.get('steamid')}"
-                    )
-
-                case "listing-delete":
-                    listings_to_update["delete"].append(
-                        {
-                            "name": item_name,
-                            "intent": data.get("intent"),
-                            "steamid": data.get("steamid"),
-                        }
-                    )
-                    self.logger.debug(f"listing-delete for {item_name} with intent {data.get("intent")}" f" and steamid {data.get("steamid")}")
-
-                case _:
-                    continue
-        self.pricer.database.update_many(listings_to_update)
+        # In sharded mode the worker processes reformat and write, this process only filters and routes
+        if self.pricer.shards:
+            await self.pricer.shards.dispatch(self.decoder.select(events, self.pricer.pricelist.is_tracked))
+            return
+        for event, data in self.decoder.select(events, self.pricer.pricelist.is_tracked):
+            await self.handle_event(data, event)
 
     async def process_listing(self, data: dict, item_name: str) -> None:
         # Reformat the data
-        listing_data = await self.reformat_event(data)
+        listing_data = await self.reformat_event(data, self.pricer.options.retainFullListings, self.pricer.options.flagRules)
         # If the data is empty, exit the function
         if not listing_data:
             return
 
-        # Insert the listing into the database
-        await self.pricer.database.insert_listing(
-            item_name,
-            listing_data.get("intent"),
-            listing_data.get("steamid"),
-            listing_data,
-        )
+        # Queue the listing for the database writer
+        await self.ingestion.put("insert", self.insert_operation(item_name, listing_data))
         self.logger.debug(f"listing-update for {item_name} with intent {listing_data.get('intent')}" f" and steamid {listing_data.get('steamid')}")
 
     async def process_deletion(self, item_name: str, intent: str, steamid: str) -> None:
-        # Delete the listing from the database
-        await self.pricer.database.delete_listing(item_name, intent, steamid)
+        # Queue the deletion for the database writer
+        await self.ingestion.put("delete", self.delete_operation(item_name, intent, steamid))
         self.logger.debug(f"listing-delete for {item_name} with intent {intent} and steamid {steamid}")
+
+    # Ingestion telemetry for the health endpoint
+    def get_statistics(self) -> dict:
+        statistics = self.telemetry.get_statistics()
+        statistics["queue"] = self.ingestion.get_statistics()
+        if self.pricer.shards:
+            statistics["shards"] = self.pricer.shards.get_statistics()
+        return statistics
@@ -0,0 +1,119 @@
+# Websocket Frame Decoder
+
+from logging import getLogger
+from json import loads
+from re import compile
+from typing import Callable, Iterator
+from .telemetry import Telemetry
+
+try:
+    from orjson import loads as orjson_loads
+except ImportError:
+    orjson_loads = None
+
+BACKENDS: dict[str, Callable] = {"json": loads}
+if orjson_loads is not None:
+    BACKENDS["orjson"] = orjson_loads
+
+SEPARATOR = compile(r"\}\s*,\s*\{")  # Between events, but also between objects nested in a listing
+NAME = compile(r'"name"\s*:\s*"([^"]*)"')  # A name with an escaped quote is cut at the backslash
+
+
+class Decoder:
+    logger = getLogger("Decoder")
+
+    def __init__(self, backend: str = "auto", lazy: bool | str = "auto", telemetry: Telemetry = None):
+        if backend == "auto":
+            backend = "orjson" if "orjson" in BACKENDS else "json"
+        if backend not in BACKENDS:
+            self.logger.warning(f"JSON backend {backend} is not available, falling back to json.")
+            backend = "json"
+
+        self.backend = backend
+        self.loads = BACKENDS[backend]
+        # Cutting events out of the raw frame beats parsing all of it with json, orjson parses faster than the split
+        self.lazy = backend == "json" if lazy == "auto" else lazy
+        self.telemetry = telemetry or Telemetry()
+        self.logger.debug(f"Using {self.backend} backend (Lazy: {self.lazy}).")
+
+    # Turn a raw frame into a list of events, single event frames are wrapped.
+    # In lazy mode events that can't be for a tracked item are cut out of the raw frame before it is parsed
+    def decode(self, message: str | bytes, is_tracked: Callable[[str], bool] = None) -> list:
+        if self.lazy and is_tracked is not None:
+            frame = self.decode_tracked(message, is_tracked)
+            if frame is not None:
+                return frame
+        frame = self.loads(message)
+        if not isinstance(frame, list):
+            frame = [frame] if frame else []
+        self.telemetry.increment("frames")
+        self.telemetry.increment("events", len(frame))
+        return frame
+
+    # The top-level events of a frame as raw strings. A separator only ends an event where the braces since the
+    # start of the event are balanced and no string is open, counted with str.count so nothing is parsed. Braces
+    # inside strings throw the count off, that is caught by the total at the end and the frame is parsed in full
+    @staticmethod
+    def split_events(body: str) -> list[str]:
+        escaped = '\\"' in body  # Most frames have no escaped quotes, every quote opens or closes a string
+
+        def closed(start: int, end: int = None) -> bool:
+            return (body.count('"', start, end) - (body.count('\\"', start, end) if escaped else 0)) % 2 == 0
+
+        events = list()
+        start = counted = depth = 0
+        for match in SEPARATOR.finditer(body):
+            end = match.start() + 1
+            depth += body.count("{", counted, end) - body.count("}", counted, end)
+            counted = end
+            if depth == 0 and closed(start, end):
+                events.append(body[start:end])
+                start = counted = match.end() - 1
+        depth += body.count("{", counted) - body.count("}", counted)
+        if depth != 0 or not closed(start, len(body)):
+            return None
+        events.append(body[start:])
+        return events
+
+    # Only parse the events that mention a tracked "name". The name check only ever keeps too much, select still
+    # checks the parsed item name. When the split can't be trusted the whole frame is parsed instead
+    def decode_tracked(self, message: str | bytes, is_tracked: Callable[[str], bool]) -> list:
+        if isinstance(message, bytes):
+            message = message.decode()
+        message = message.strip()
+        if not message.startswith("[{") or not message.endswith("}]"):
+            return None  # Single event or empty frames
+
+        pieces = self.split_events(message[1:-1])
+        if pieces is None:
+            return None
+        kept = [
+            piece
+            for piece in pieces
+            if any("\\" in name or is_tracked(name) for name in NAME.findall(piece))  # Escaped names are checked once parsed
+        ]
+        if not kept:
+            frame = []
+        else:
+            try:
+                frame = self.loads("[" + ",".join(kept) + "]")
+            except ValueError:
+                return None
+            if len(frame) != len(kept):
+                return None
+
+        self.telemetry.increment("frames")
+        self.telemetry.increment("events", len(pieces))
+        self.telemetry.increment("skipped", len(pieces) - len(kept))
+        return frame
+
+    # Yield (event, payload) pairs, in lazy mode untracked items are dropped before anything else touches them
+    def select(self, frame: list, is_tracked: Callable[[str], bool]) -> Iterator[tuple[str, dict]]:
+        filtered = 0
+        for event in frame:
+            payload = event.get("payload", event)
+            if self.lazy and not is_tracked((payload.get("item") or {}).get("name")):
+                filtered += 1
+                continue
+            yield event.get("event"), payload
+        self.telemetry.increment("filtered", filtered)
@@ -0,0 +1,91 @@
+# Listing Projection
+
+from json import dumps
+from zlib import crc32
+from .currencies import Currencies
+
+# The fields Pricer.calculate_price reads, everything else is dropped at ingest unless full retention is enabled
+
+
+def project_listing(listing: dict, retain_full: bool = False, flag_rules: "FlagRules" = None) -> dict:
+    item = listing.get("item") or dict()
+    compact = {
+        "steamid": listing.get("steamid"),
+        "intent": listing.get("intent"),
+        "currencies": listing.get("currencies"),
+        "details": listing.get("details"),
+        "listed_at": listing.get("listed_at"),
+        "bumped_at": listing.get("bumped_at"),
+        "is_bot": listing.get("user_agent") is not None,
+        "attributes": [attribute.get("defindex") for attribute in item.get("attributes") or []],
+    }
+    if flag_rules:
+        compact.update(flag_rules.derive(compact))
+    if retain_full:
+        return {**listing, **compact}
+    return compact
+
+
+class FlagRules:
+    # Stage 1 checks of Pricer.calculate_price that only depend on the listing and the options, derived
+    # once when the listing is stored. version changes with the options the flags depend on, listings
+    # with another version are derived again while pricing until the background re-derivation reaches them
+    def __init__(self, json_options: dict):
+        self.blocked_defindexes = {str(attribute["defindex"]) for attribute in json_options["blockedAttributes"]}
+        self.excluded_descriptions = list(json_options["excludedListingDescriptions"])
+        self.version = f"{crc32(dumps([sorted(self.blocked_defindexes), self.excluded_descriptions]).encode('utf-8')):08x}"
+
+    def derive(self, listing: dict) -> dict:
+        currencies = listing.get("currencies") or dict()
+        normalized = Currencies(currencies)
+        return {
+            "is_bot": is_bot(listing),
+            "has_usd": "usd" in currencies,
+            "keys": normalized.keys,
+            "scrap": Currencies.toScrap(normalized.metal),  # Currencies.toValue without the keys
+            **self.derive_options(listing),
+        }
+
+    # Only the flags that depend on the options, what a re-derivation after an options change writes
+    def derive_options(self, listing: dict) -> dict:
+        details = listing.get("details") or ""
+        return {
+            "blocked": any(str(defindex) in self.blocked_defindexes for defindex in attribute_defindexes(listing)),
+            "excluded": any(excluded in details for excluded in self.excluded_descriptions),
+            "flags_version": self.version,
+        }
+
+    def ensure(self, listing: dict) -> dict:
+        if listing.get("flags_version") == self.version:
+            return listing
+        return {**listing, **self.derive(listing)}
+
+
+# Readers that also understand listings stored before the projection existed
+def is_bot(listing: dict) -> bool:
+    if "is_bot" in listing:
+        return listing["is_bot"]
+    return listing.get("user_agent") is not None
+
+
+def attribute_defindexes(listing: dict) -> list:
+    if "attributes" in listing:
+        return listing["attributes"]
+    return [attribute["defindex"] for attribute in (listing.get("item") or dict()).get("attributes") or []]
+
+
+# The smaller copy kept by the in-process listing store, active_at is when the listing was last bumped
+def pricing_listing(listing: dict) -> dict:
+    return {
+        "steamid": listing.get("steamid"),
+        "intent": listing.get("intent"),
+        "currencies": listing.get("currencies"),
+        "details": listing.get("details"),
+        "is_bot": is_bot(listing),
+        "attributes": attribute_defindexes(listing),
+        "active_at": listing.get("bumped_at") or listing.get("listed_at"),
+        **{key: listing[key] for key in FLAG_FIELDS if key in listing},
+    }
+
+
+FLAG_FIELDS = ("has_usd", "blocked", "excluded", "keys", "scrap", "flags_version")
@@ -0,0 +1,66 @@
+# Rate Limiting
+
+from datetime import datetime, UTC
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import monotonic, sleep
+
+RATE_RECOVERY = 0.02  # Share of the configured rate won back per successful request
+
+
+class TokenBucket:
+    # Hands out requests at up to rate per second, with up to a second worth of them at once.
+    # A 429 halves the rate and holds everyone back until Retry-After, successful requests win the rate
+    # back a little at a time so the limiter settles just below what the server allows
+    def __init__(self, rate: float, min_rate: float = None):
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.rate = rate
+        self.burst = max(1.0, rate)
+
+        self.lock = Lock()
+        self.tokens = 1.0
+        self.updated = monotonic()  # Tokens are refilled from here, pushed into the future while paused
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.updated - now
+            sleep(wait)
+
+    def throttle(self, retry_after: float = None):
+        with self.lock:
+            if monotonic() >= self.updated:
+                self.rate = max(self.min_rate, self.rate / 2)  # Requests that were already in flight only extend the pause
+            self.tokens = 0.0
+            self.updated = max(self.updated, monotonic() + (retry_after if retry_after is not None else 1 / self.rate))
+
+    def succeed(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_RECOVERY)
+
+    def get_statistics(self) -> dict:
+        return {"rate": round(self.rate, 3), "max_rate": self.max_rate, "paused": max(0.0, round(self.updated - monotonic(), 3))}
+
+
+def parse_retry_after(value: str) -> float:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(UTC)).total_seconds())
+    except (TypeError, ValueError):
+        return None
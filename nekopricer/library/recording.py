@@ -0,0 +1,82 @@
+# Websocket Recorder & Replayer
+
+from logging import getLogger
+from asyncio import Event, sleep, get_running_loop
+from gzip import open as gzip_open
+from time import time
+from typing import Iterator
+from websockets import connect, serve, ConnectionClosed
+
+# Recordings are gzip compressed text, one "<unix time>\t<raw frame>" line per frame
+
+
+def read_recording(path: str) -> Iterator[tuple[float, str]]:
+    with gzip_open(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            timestamp, _, message = line.rstrip("\n").partition("\t")
+            if message:
+                yield float(timestamp), message
+
+
+class Recorder:
+    logger = getLogger("Recorder")
+
+    def __init__(self, url: str, path: str):
+        self.url = url
+        self.path = path
+
+        self.frames = 0
+        self.bytes = 0
+
+    async def record(self, duration: float = None, limit: int = None):
+        deadline = time() + duration if duration else None
+        with gzip_open(self.path, "at", encoding="utf-8") as file:
+            async with connect(uri=self.url, max_size=None, ping_interval=60, ping_timeout=120) as websocket:
+                self.logger.info(f"Recording {self.url} to {self.path}...")
+                async for message in websocket:
+                    if isinstance(message, bytes):
+                        message = message.decode("utf-8")
+                    file.write(f"{time():.3f}\t{message}\n")
+                    self.frames += 1
+                    self.bytes += len(message)
+                    if (limit and self.frames >= limit) or (deadline and time() >= deadline):
+                        break
+        self.logger.info(f"Recorded {self.frames} frames ({self.bytes / 1_000_000:.1f} MB uncompressed).")
+
+
+class Replayer:
+    logger = getLogger("Replayer")
+
+    # A speed of 1 keeps the recorded pacing, N plays N times faster and 0 sends as fast as possible
+    def __init__(self, path: str, speed: float = 1):
+        self.frames = list(read_recording(path))
+        self.speed = speed
+
+        self.sent = 0
+        self.started = 0
+        self.finished = Event()
+
+    async def handler(self, websocket):
+        if self.finished.is_set() or self.started:
+            await websocket.close()  # Only one client gets the recording
+            return
+        loop = get_running_loop()
+        self.started = loop.time()
+        first = self.frames[0][0] if self.frames else 0
+        try:
+            for timestamp, message in self.frames:
+                if self.speed:
+                    delay = (timestamp - first) / self.speed - (loop.time() - self.started)
+                    if delay > 0:
+                        await sleep(delay)
+                await websocket.send(message)
+                self.sent += 1
+        except ConnectionClosed as e:
+            self.logger.error(f"Client disconnected during replay: {e}")
+        self.logger.info(f"Replayed {self.sent} / {len(self.frames)} frames.")
+        self.finished.set()
+        await websocket.close()
+
+    def serve(self, host: str = "127.0.0.1", port: int = 0):
+        # Use as "async with replayer.serve() as server", the bound port is in server.sockets
+        return serve(self.handler, host, port, max_size=None)
@@ -0,0 +1,74 @@
+# Ingestion Telemetry
+
+from collections import defaultdict, deque
+from threading import Lock
+from time import time
+
+
+class Telemetry:
+    # Counters keep a total plus per-second buckets for a rolling rate, samples keep the most recent
+    # observations for percentiles and gauges hold the last value that was set
+    def __init__(self, window: int = 60, samples: int = 2048):
+        self.window = window
+        self.started = time()
+
+        self.lock = Lock()
+        self.totals = defaultdict(int)
+        self.buckets = defaultdict(deque)
+        self.samples = defaultdict(lambda: deque(maxlen=samples))
+        self.gauges = dict()
+
+    def increment(self, name: str, amount: int = 1):
+        if not amount:
+            return
+        second = int(time())
+        with self.lock:
+            self.totals[name] += amount
+            buckets = self.buckets[name]
+            if buckets and buckets[-1][0] == second:
+                buckets[-1][1] += amount
+            else:
+                buckets.append([second, amount])
+                while buckets[0][0] <= second - self.window:
+                    buckets.popleft()
+
+    def observe(self, name: str, *values: float):
+        with self.lock:
+            self.samples[name].extend(values)
+
+    def set(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def rate(self, name: str) -> float:
+        cutoff = int(time()) - self.window
+        with self.lock:
+            total = sum(count for second, count in self.buckets[name] if second > cutoff)
+        return total / min(self.window, max(time() - self.started, 1))
+
+    @staticmethod
+    def percentiles(values: list) -> dict:
+        if not values:
+            return {"p50": 0, "p95": 0, "p99": 0, "max": 0, "samples": 0}
+        values = sorted(values)
+        last = len(values) - 1
+        return {
+            "p50": values[round(last * 0.50)],
+            "p95": values[round(last * 0.95)],
+            "p99": values[round(last * 0.99)],
+            "max": values[last],
+            "samples": len(values),
+        }
+
+    def get_statistics(self) -> dict:
+        with self.lock:
+            totals = dict(self.totals)
+            samples = {name: list(values) for name, values in self.samples.items()}
+            gauges = dict(self.gauges)
+        return {
+            "uptime": int(time() - self.started),
+            "totals": totals,
+            "rates": {name: round(self.rate(name), 2) for name in totals},
+            "percentiles": {name: self.percentiles(values) for name, values in samples.items()},
+            "gauges": gauges,
+        }